@@ -1,5 +1,20 @@
+import asyncio
+import bisect
+import collections.abc
+import concurrent.futures as futures
+import contextlib
+import glob
+import hashlib
+import io
 import itertools
+import json
+import mmap
+import os
 import struct
+import sys
+import time
+
+import mbf
 
 class _Token:
     """A class to to hold (number,description), with some classmethods to help build them"""
@@ -17,30 +32,30 @@ class _Token:
             desc = str(num)
         return cls(-1, desc) 
 
-    @classmethod
-    def from_float(cls, num):
-        return cls(-1, f'{num:E}') 
-
     @classmethod
     def from_string(cls, num, desc):
         return cls(num, desc)
 
     @classmethod
     def from_opcode(cls, tok, rdr):
-        desc = _opcodes.get(tok)
-        if callable(desc):
-            return desc(rdr)
-        return cls(tok, desc or f'<UNK 0x{tok:X}>')
+        if tok > 0xFF:
+            return cls(tok, _prefixed[tok >> 8][tok & 0xFF])
+        desc = _single[tok]
+        if desc is not None:
+            return cls(tok, desc)
+        if tok == 0:
+            return cls(0, 'EOL')
+        size, fmt = _literals[tok]
+        return cls(-1, fmt(rdr.read(size), 0))
        
 
 class _Reader:
     """A class to read various binary data types from the binary file F.""" 
+    s16  = struct.Struct('<h')
+    su16 = struct.Struct('<H')
+
     def __init__(self,f):
         self.f = f
-        self.s16  = struct.Struct('<h')
-        self.su16 = struct.Struct('<H')
-        self.sf32 = struct.Struct('<f')
-        self.sf64 = struct.Struct('<d')
    
     def read(self, n):
         """Read _exactly_ N bytes from the file, or throw an exception"""
@@ -64,27 +79,10 @@ class _Reader:
         return self.su16.unpack(self.read(2))[0]
 
     def read_f32(self):
-        bs = bytearray(self.read(4))
-        if bs[3] == 0:  return 0.0
-        sgn, exp = bs[2] & 0x80, (bs[3] - 2) & 0xff
-        bs[3] = sgn | (exp >> 1)
-        bs[2] = ((exp << 7) | (bs[2] & 0x7f)) & 0xff
-        return self.sf32.unpack(bs)[0]
-      
+        return mbf.mbf32_to_float(self.read(4))
+
     def read_f64(self):
-        bs = bytearray(self.read(8))
-        if bs[7] == 0: return 0.0
-        sgn = bs[6] & 0x80 
-        exp = (bs[3] - 128 - 1 + 1023) & 0xffff
-        bs[7] = sgn | ((exp >> 4) & 0xff)
-        leftOver = (exp << 4) & 0xff
-        for idx in range(6, 0, -1):
-            tmp = ((bs[idx] << 1) & 0xff) | (bs[idx-1] >> 7)
-            bs[idx] = leftOver | (tmp >> 4)
-            leftOver = (tmp << 4) & 0xff
-        tmp = (bs[0] << 1) & 0xff
-        bs[0] = leftOver | (tmp >> 4)
-        return self.sf64.unpack(bs)[0]
+        return mbf.mbf64_to_float(self.read(8))
 
 # A decrypter for protected BAS files.
 # I found the algorithm in a python program ("PC-BASIC"),
@@ -96,25 +94,53 @@ class _Reader:
 # in a cycle across the bytes of the input.  Also, a reversed 11-index is subtracted
 # from the byte, while a reversed 13-index is added to the byte. By 'reversed', I
 # mean that as the 11-index goes from 0 to 10, the reversed index goes from 11 to 1.
+#
+# Since 11 and 13 are coprime, the whole thing repeats every 143 bytes.  So, we
+# precompute a 256-byte translation table for each of the 143 positions in the
+# cycle, and decrypt large blocks with one bytes.translate() per position.
+def _cipher_tables(key11, key13):
+    """Build the 143 per-position translation tables for the key cycle"""
+    tables = []
+    for pos in range(11*13):
+        idx11, idx13 = pos % 11, pos % 13
+        tables.append(bytes( ((((b - (11 - idx11)) ^ key11[idx11] ^ key13[idx13]) + (13 - idx13)) & 0xFF)
+                             for b in range(256) ))
+    return tables
+
 class _Decryptor(_Reader):
-    """A _Reader that decrypts data as it goes."""
+    """A _Reader that decrypts data as it goes.  POS is the starting
+       position in the 143-byte key cycle."""
     key13 = [ 0xA9, 0x84, 0x8D, 0xCD, 0x75, 0x83, 
               0x43, 0x63, 0x24, 0x83, 0x19, 0xF7, 0x9A ]
     key11 = [ 0x1E, 0x1D, 0xC4, 0x77, 0x26, 
               0x97, 0xE0, 0x74, 0x59, 0x88, 0x7C ]
-    def __init__(self, f):
+    tables = _cipher_tables(key11, key13)
+    def __init__(self, f, pos=0):
         super(_Decryptor,self).__init__(f)
-        self.idx11 = 0 
-        self.idx13 = 0
+        self.pos = pos % 143
+    @property
+    def idx11(self): return self.pos % 11
+    @property
+    def idx13(self): return self.pos % 13
     def decrypt(self, b):
-        for idx in range(len(b)):
-            b[idx] = self.decrypt1(b[idx])
+        """Decrypt bytearray B in place, picking up the key cycle where the
+           last call left off, and return it"""
+        n, pos, tables = len(b), self.pos, self.tables
+        if n < 143:
+            for idx in range(n):
+                b[idx] = tables[(pos + idx) % 143][b[idx]]
+        else:
+            for phase in range(143):
+                start = (phase - pos) % 143
+                b[start::143] = b[start::143].translate(tables[phase])
+        self.pos = (pos + n) % 143
         return b
     def decrypt1(self, b):
+        """Decrypt a single byte the long way (the reference for decrypt)"""
         ans = b - (11 - self.idx11)
         ans = ans ^ self.key11[self.idx11] ^ self.key13[self.idx13]
         ans += (13 - self.idx13)
-        self.idx11, self.idx13 = (self.idx11+1) % 11, (self.idx13+1) % 13
+        self.pos = (self.pos + 1) % 143
         return (ans & 0xFF)
     def read(self, n):
         data = super(_Decryptor, self).read(n)
@@ -130,12 +156,19 @@ def _get_reader(f):
     else:
         raise ValueError(f'Not a GW-BASIC file! (first byte was 0x{first_byte:X})')
 
+def _map_file(f):
+    """Get the contents of open file F as a buffer, memory-mapping it when
+       possible.  The result is a context manager."""
+    try:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # not a real file, or an empty one... just read it
+        return contextlib.nullcontext(f.read())
+
 def _get_token(rdr):
     """Read and create the next _Token from the file"""
     nxt = rdr.read_u8()
-    if nxt in range(0x20,0x7F):  
-        return _Token.from_string(nxt,chr(nxt))
-    elif nxt in range(0xFD, 0x100): 
+    if nxt >= 0xFD:
         return _Token.from_opcode( (nxt << 8) | rdr.read_u8() , rdr)
     else:
         return _Token.from_opcode(nxt,rdr) 
@@ -184,12 +217,363 @@ def gwbas_lines(f):
                 break
             yield _format(line)
 
-_opcodes = {
-    0x00: "EOL",
-    0x0B: (lambda rdr: _Token.from_number(rdr.read_16(), 8)),
-    0x0C: (lambda rdr: _Token.from_number(rdr.read_16(), 16)),
-    0x0E: (lambda rdr: _Token.from_number(rdr.read_u16(), 10)),
-    0x0F: (lambda rdr: _Token.from_number(rdr.read_u8(), 10)),
+def _decode_line(buf, pos):
+    """Decode one line's tokens, starting at POS in BUF, straight into a
+       string via the flat _single/_prefixed/_literals tables.  The :ELSE,
+       :REM' and WHILE+ rewrites of _format() are done by peeking ahead.
+       Returns (text, position after the line)."""
+    single, prefixed, literals = _single, _prefixed, _literals
+    out = []
+    while True:
+        b = buf[pos]
+        desc = single[b]
+        if desc is not None:
+            if b == 0x3A:
+                nb = buf[pos+1]
+                if nb == 0xA1:                          # ":ELSE" --> "ELSE"
+                    pos += 1
+                    continue
+                if nb == 0x8F and buf[pos+2] == 0xD9:   # ":REM'" --> "'"
+                    pos += 2
+                    continue
+            elif b == 0xB1 and buf[pos+1] == 0xE9:      # "WHILE+" --> "WHILE"
+                pos += 1
+            out.append(desc)
+            pos += 1
+        elif b == 0:
+            return ''.join(out), pos + 1
+        elif b >= 0xFD:
+            out.append(prefixed[b][buf[pos+1]])
+            pos += 2
+        else:
+            size, fmt = literals[b]
+            out.append(fmt(buf, pos+1))
+            pos += size + 1
+
+def _decode_lines(buf, pos):
+    """Generate the formatted lines in BUF, starting at POS, without building
+       any _Token objects along the way."""
+    su16 = _Reader.su16
+    try:
+        while su16.unpack_from(buf, pos)[0] != 0:
+            lineno = su16.unpack_from(buf, pos+2)[0]
+            text, pos = _decode_line(buf, pos+4)
+            yield f'{lineno}  {text}'
+    except (IndexError, struct.error):
+        raise IOError('Early EOF!') from None
+
+def gwbas_lines_fast(f):
+    """Generate the GW-BASIC lines from file|filename f, like gwbas_lines(),
+       but decode straight from the memory-mapped bytes to strings."""
+    if isinstance(f, str):
+        f = open(f, 'rb')
+    with f, _map_file(f) as buf:
+        first_byte = buf[0]
+        if first_byte == 0xFF:
+            yield from _decode_lines(buf, 1)
+        elif first_byte == 0xFE:
+            yield from _decode_lines(_Decryptor(None).decrypt(bytearray(buf[1:])), 0)
+        else:
+            raise ValueError(f'Not a GW-BASIC file! (first byte was 0x{first_byte:X})')
+
+def _skip_line(buf, pos):
+    """Find the end of the line whose tokens start at POS in BUF, without
+       decoding anything.  Returns the position after the line."""
+    sizes = _token_sizes
+    while True:
+        b = buf[pos]
+        if b == 0: return pos + 1
+        pos += sizes[b]
+
+def build_index(f):
+    """Scan file|filename f and return its line index: a dict with a
+       'protected' flag, the 'end' offset of the program, and 'lines', a
+       list of [line number, file offset, cipher position] for each line.  
+       The cipher position is where the decryption key cycle stands at that 
+       line (None for unprotected files)."""
+    if isinstance(f, str):
+        f = open(f, 'rb')
+    with f, _map_file(f) as buf:
+        protected = (buf[0] == 0xFE)
+        if protected:
+            buf = _Decryptor(None).decrypt(bytearray(buf[1:]))
+        elif buf[0] != 0xFF:
+            raise ValueError(f'Not a GW-BASIC file! (first byte was 0x{buf[0]:X})')
+        base, pos, lines = (1 if protected else 0), (0 if protected else 1), []
+        su16 = _Reader.su16
+        try:
+            while su16.unpack_from(buf, pos)[0] != 0:
+                lines.append([ su16.unpack_from(buf, pos+2)[0], pos + base, 
+                               (pos % 143) if protected else None ])
+                pos = _skip_line(buf, pos+4)
+        except (IndexError, struct.error):
+            raise IOError('Early EOF!') from None
+        return { 'protected': protected, 'end': pos + base, 'lines': lines }
+
+def _file_digest(fname):
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def line_index(fname):
+    """Get the line index for FNAME (see build_index), from the sidecar
+       cache file FNAME.idx when it matches the file's mtime or contents.
+       Otherwise, build the index and write the cache."""
+    st, cache_name = os.stat(fname), fname + '.idx'
+    digest, index = None, None
+    try:
+        with open(cache_name) as cf:
+            cached = json.load(cf)
+        if cached['size'] == st.st_size:
+            if cached['mtime'] == st.st_mtime_ns:
+                return cached
+            digest = _file_digest(fname)
+            if cached['sha1'] == digest:
+                index = cached  # same contents, just touched
+    except (OSError, ValueError, KeyError):
+        pass  # no usable cache... just build it
+    if index is None:
+        index = build_index(fname)
+    index.update(sha1=digest or _file_digest(fname), mtime=st.st_mtime_ns, size=st.st_size)
+    try:
+        with open(cache_name, 'w') as cf:
+            json.dump(index, cf)
+    except OSError:
+        pass  # a read-only archive, perhaps
+    return index
+
+def gwbas_line_range(fname, first=0, last=65535):
+    """Generate the GW-BASIC lines numbered FIRST through LAST from FNAME,
+       decoding only those lines with the help of the line index."""
+    index = line_index(fname)
+    lines = index['lines']
+    linenos = [ l[0] for l in lines ]
+    lo, hi = bisect.bisect_left(linenos, first), bisect.bisect_right(linenos, last)
+    if lo >= hi: return
+    start = lines[lo][1]
+    stop = lines[hi][1] if hi < len(lines) else index['end']
+    with open(fname, 'rb') as f, _map_file(f) as buf:
+        if index['protected']:
+            buf = _Decryptor(None, lines[lo][2]).decrypt(bytearray(buf[start:stop]))
+            base = start
+        else:
+            base = 0
+        try:
+            for lineno, offset, _ in lines[lo:hi]:
+                yield f'{lineno}  {_decode_line(buf, offset - base + 4)[0]}'
+        except (IndexError, struct.error):
+            raise IOError('Early EOF!') from None
+
+class AsyncFileSource:
+    """An async byte source for agwbas_lines(), reading the file|filename F
+       in the default executor.  Any object with an awaitable read(n), like
+       an asyncio.StreamReader, can be a source."""
+    def __init__(self, f):
+        self.f = open(f, 'rb') if isinstance(f, str) else f
+
+    async def read(self, n):
+        return await asyncio.get_running_loop().run_in_executor(None, self.f.read, n)
+
+    def close(self):
+        self.f.close()
+
+async def agwbas_lines(source, chunk_size=16384):
+    """Asynchronously generate the GW-BASIC lines from the async byte SOURCE,
+       with the same output as gwbas_lines().  At most a couple of 
+       CHUNK_SIZE reads are buffered at a time."""
+    first = await source.read(1)
+    if first == b'':
+        raise IOError('Early EOF!')
+    if first[0] == 0xFE:
+        decryptor = _Decryptor(None)
+    elif first[0] == 0xFF:
+        decryptor = None
+    else:
+        raise ValueError(f'Not a GW-BASIC file! (first byte was 0x{first[0]:X})')
+    buf, pos, su16 = bytearray(), 0, _Reader.su16
+
+    async def fill():
+        nonlocal buf, pos
+        data = await source.read(chunk_size)
+        if not data:
+            raise IOError('Early EOF!')
+        if pos > chunk_size:
+            del buf[:pos]
+            pos = 0
+        buf += decryptor.decrypt(bytearray(data)) if decryptor else data
+
+    while True:
+        while len(buf) - pos < 2: await fill()
+        if su16.unpack_from(buf, pos)[0] == 0:
+            return
+        while True:
+            try:
+                end = _skip_line(buf, pos+4)
+                break
+            except IndexError:
+                await fill()   # don't have the whole line yet
+        lineno = su16.unpack_from(buf, pos+2)[0]
+        text, pos = _decode_line(buf, pos+4)
+        yield f'{lineno}  {text}'
+
+def _expand_sources(sources):
+    """Turn the files, directories and globs in SOURCES into a list of
+       (root, path) pairs, where ROOT is the part of PATH to leave off 
+       when mirroring it into an output tree.  Files named outright share
+       the deepest directory they all sit under as their root, so d1/A.BAS
+       and d2/A.BAS don't land on the same output.  A file named more than
+       once is only listed the first time."""
+    found, files = [], [ src for src in sources 
+                         if not os.path.isdir(src) and not glob.has_magic(src) ]
+    try:
+        file_root = os.path.commonpath([ os.path.dirname(os.path.abspath(f)) for f in files ]) if files else ''
+    except ValueError:
+        file_root = os.getcwd()  # on different drives
+    for src in sources:
+        if os.path.isdir(src):
+            for dirpath, _, fnames in os.walk(src):
+                found.extend( (src, os.path.join(dirpath, fn)) 
+                              for fn in sorted(fnames) if fn.lower().endswith('.bas') )
+        elif glob.has_magic(src):
+            root = os.path.dirname(src.split('*')[0].split('?')[0].split('[')[0])
+            found.extend( (root, fn) for fn in sorted(glob.glob(src, recursive=True)) 
+                                     if os.path.isfile(fn) )
+        else:
+            found.append( (file_root, src) )
+    seen, unique = set(), []
+    for root, src in found:
+        key = os.path.normcase(os.path.abspath(src))
+        if key not in seen:
+            seen.add(key)
+            unique.append( (root, src) )
+    return unique
+
+def _convert_one(src, dst, mapped):
+    """Write the listing of SRC to DST.  Returns (src, bytes, lines, error),
+       where ERROR is None on success."""
+    lines = gwbas_lines_fast if mapped else gwbas_lines
+    try:
+        listing = list(lines(src))
+        os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+        with open(dst, 'w') as out:
+            for l in listing:
+                print(l, file=out)
+        return (src, os.path.getsize(src), len(listing), None)
+    except (OSError, ValueError, IndexError) as e:
+        return (src, 0, 0, f'{type(e).__name__}: {e}')
+
+def batch_convert(sources, outdir, jobs=None, mapped=False):
+    """Convert every BAS file named by SOURCES (files, directories, or globs)
+       into a .txt listing under OUTDIR, mirroring the input tree.  The files 
+       are spread over JOBS processes.  Errors are reported per-file on stderr,
+       and a throughput summary is printed at the end.  A file whose listing
+       would overwrite another's is counted as failed, and not converted."""
+    jobs = jobs or os.cpu_count() or 1
+    work = _expand_sources(sources)
+    start = time.perf_counter()
+    nfiles = nbytes = nlines = failed = 0
+    written, todo = {}, []
+    for root, src in work:
+        dst = os.path.join(outdir, os.path.splitext(os.path.relpath(src, root or '.'))[0] + '.txt')
+        key = os.path.normcase(os.path.normpath(dst))
+        if key in written:
+            nfiles, failed = nfiles + 1, failed + 1
+            print(f'{src}: {dst} is already the listing of {written[key]}', file=sys.stderr)
+        else:
+            written[key] = src
+            todo.append( (src, dst) )
+    with futures.ProcessPoolExecutor(jobs) as pool:
+        pending, work = set(), iter(todo)
+        while True:
+            # keep a bounded number of files in flight
+            for src, dst in itertools.islice(work, jobs*4 - len(pending)):
+                pending.add(pool.submit(_convert_one, src, dst, mapped))
+            if not pending:
+                break
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for fut in done:
+                src, b, n, err = fut.result()
+                if err:
+                    failed += 1
+                    print(f'{src}: {err}', file=sys.stderr)
+                nfiles, nbytes, nlines = nfiles + 1, nbytes + b, nlines + n
+    secs = time.perf_counter() - start
+    print(f'{nfiles} files ({failed} failed), {nlines} lines, {nbytes/(1024*1024):.2f} MB in {secs:.2f}s: '
+          f'{nfiles/secs:.1f} files/s, {nbytes/(1024*1024)/secs:.2f} MB/s, {nlines/secs:.0f} lines/s')
+    return failed
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# The token tables.
+#
+# Both decoders dispatch on flat tables, indexed by byte:
+#   _single      : the text for each single-byte token, or None for EOL, the
+#                  0xFD/0xFE/0xFF prefixes, and numeric literals
+#   _prefixed    : for each prefix byte, the text for each possible second byte
+#   _literals    : for each numeric literal opcode, (payload size, formatter)
+#   _token_sizes : how many bytes each token takes, for skipping
+#
+# Don't edit them directly: keywords go through OPCODES, and numeric
+# literals through register_literal().
+_single = [ f'<UNK 0x{b:X}>' for b in range(256) ]
+for b in range(0x20, 0x7F): _single[b] = chr(b)
+for b in (0x00, 0xFD, 0xFE, 0xFF): _single[b] = None
+_prefixed = { p: [ f'<UNK 0x{(p << 8) | b:X}>' for b in range(256) ] for p in (0xFD, 0xFE, 0xFF) }
+_literals = {}
+_token_sizes = [ (2 if b >= 0xFD else 1) for b in range(256) ]
+
+class OpcodeTable(collections.abc.MutableMapping):
+    """The keyword text for each opcode: 0x01-0xFC, or 0xFD00-0xFFFF for the
+       prefixed ones.  Changes go straight into the flat decoding tables, so
+       a dialect (like PC-BASIC's extensions) can add its keywords with e.g.
+       OPCODES[0xFEA9] = 'DEBUG' without touching the decoders."""
+    def __init__(self, keywords):
+        self.descs = {}
+        self.update(keywords)
+
+    @staticmethod
+    def _slot(tok):
+        """Find the table and index that hold opcode TOK"""
+        if 0xFD00 <= tok <= 0xFFFF:
+            return _prefixed[tok >> 8], tok & 0xFF
+        if tok in range(0x20, 0x7F) or tok in (0x00, 0xFD, 0xFE, 0xFF) or not (0 <= tok <= 0xFF):
+            raise KeyError(f'0x{tok:X} is not a keyword opcode')
+        return _single, tok
+
+    def __getitem__(self, tok):
+        return self.descs[tok]
+
+    def __setitem__(self, tok, desc):
+        table, idx = self._slot(tok)
+        if tok in _literals:
+            raise KeyError(f'0x{tok:X} is a numeric literal opcode')
+        table[idx] = self.descs[tok] = desc
+
+    def __delitem__(self, tok):
+        table, idx = self._slot(tok)
+        del self.descs[tok]
+        table[idx] = f'<UNK 0x{tok:X}>'
+
+    def __iter__(self):
+        return iter(self.descs)
+
+    def __len__(self):
+        return len(self.descs)
+
+def register_literal(tok, size, fmt):
+    """Make single-byte opcode TOK a numeric literal with a SIZE-byte payload,
+       which FMT(buffer, offset) turns into text."""
+    if not (0 <= tok <= 0xFF):
+        raise ValueError(f'0x{tok:X} is not a single-byte opcode')
+    OpcodeTable._slot(tok)   # just to check it
+    if tok in OPCODES:
+        del OPCODES[tok]
+    _literals[tok] = (size, fmt)
+    _single[tok] = None
+    _token_sizes[tok] = size + 1
+
+OPCODES = OpcodeTable({
     0x11: "0",
     0x12: "1",
     0x13: "2",
@@ -201,9 +585,6 @@ _opcodes = {
     0x19: "8",
     0x1A: "9",
     0x1B: "10",
-    0x1C: (lambda rdr: _Token.from_number(rdr.read_16(), 10)),
-    0x1D: (lambda rdr: _Token.from_float(rdr.read_f32())),
-    0x1F: (lambda rdr: _Token.from_float(rdr.read_f64())),
     0x81: "END",
     0x82: "FOR",
     0x83: "NEXT",
@@ -388,13 +769,37 @@ _opcodes = {
     0xFFA3: "EOF",
     0xFFA4: "LOC",
     0xFFA5: "LOF"
-}
+})
+
+_s16, _u16 = _Reader.s16, _Reader.su16
+register_literal(0x0B, 2, lambda buf, pos: f'&O{_s16.unpack_from(buf, pos)[0]:o}')
+register_literal(0x0C, 2, lambda buf, pos: f'&H{_s16.unpack_from(buf, pos)[0]:X}')
+register_literal(0x0E, 2, lambda buf, pos: str(_u16.unpack_from(buf, pos)[0]))
+register_literal(0x0F, 1, lambda buf, pos: str(buf[pos]))
+register_literal(0x1C, 2, lambda buf, pos: str(_s16.unpack_from(buf, pos)[0]))
+register_literal(0x1D, 4, lambda buf, pos: f'{mbf.mbf32_to_float(buf[pos:pos+4]):E}')
+register_literal(0x1F, 8, lambda buf, pos: f'{mbf.mbf64_to_float(buf[pos:pos+8]):E}')
 
 if __name__=='__main__':
     import argparse
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument("basic_file", help="the GWBAS/BASICA file to print")
+    parser.add_argument("basic_file", nargs='+', help="the GWBAS/BASICA file(s) to print (or, with -o, directories and globs)")
+    parser.add_argument("-m", dest="mapped", action="store_true", help="decode straight from memory, via mmap")
+    parser.add_argument("-o", dest="outdir", help="batch mode: write a .txt listing per file into this directory tree")
+    parser.add_argument("-j", dest="jobs", type=int, help="batch mode: how many processes to use (default: all cores)")
+    parser.add_argument("-l", dest="lines", help="only list this range of line numbers, like LIST (1000-1200, 500-, -90, 30)")
     args = parser.parse_args()
-    for l in gwbas_lines(args.basic_file):
-        print(l)
+    if args.lines:
+        first, _, last = args.lines.partition('-')
+        if '-' not in args.lines: last = first
+        for fname in args.basic_file:
+            for l in gwbas_line_range(fname, int(first or 0), int(last or 65535)):
+                print(l)
+        sys.exit(0)
+    if args.outdir:
+        sys.exit(1 if batch_convert(args.basic_file, args.outdir, args.jobs, args.mapped) else 0)
+    lines = gwbas_lines_fast if args.mapped else gwbas_lines
+    for fname in args.basic_file:
+        for l in lines(fname):
+            print(l)
 
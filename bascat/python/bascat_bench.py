@@ -0,0 +1,432 @@
+# Benchmarks for bascat.py.
+#
+# Includes a small tokenizer, to turn plain-text BASIC into the binary
+# format (optionally protected), and a generator for synthetic programs
+# of a few flavors.  The benchmarks time the different decoding paths
+# against each other.  Every path must produce exactly the same listing
+# as gwbas_lines(), or we complain.  The check command compares the fast
+# paths against the simple reference versions on random inputs.
+
+import asyncio
+import fractions
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import struct
+import tempfile
+import time
+import tracemalloc
+
+import bascat
+import mbf
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Tokenizer: plain text --> tokenized GW-BASIC
+_jumps = { 'GOTO', 'GOSUB', 'THEN', 'ELSE', 'RESTORE', 'RESUME', 'RUN' }
+_number = re.compile(r'(\d+\.?\d*|\.\d+)(E[-+]?\d+)?([#!]?)')
+_based = re.compile(r'&([HO])([0-9A-F]+)')
+
+def _keywords():
+    """(text, opcode bytes) for each keyword in bascat.OPCODES, longest first"""
+    kws = []
+    for tok, desc in bascat.OPCODES.items():
+        if 0x11 <= tok <= 0x1B or desc == "'":
+            continue   # the digits are numbers, and ' is spelled :REM'
+        kws.append( (desc, tok.to_bytes(2 if tok > 0xFF else 1, 'big')) )
+    return sorted(kws, key=lambda kw: -len(kw[0]))
+
+def _number_bytes(m, line_ref):
+    """Encode the number matched by M (a line number if LINE_REF)"""
+    digits, expo, suffix = m.groups()
+    if not (expo or suffix or '.' in digits):
+        n = int(digits)
+        if line_ref and n <= 65535: return b'\x0e' + struct.pack('<H', n)
+        if n <= 10: return bytes([0x11 + n])
+        if n <= 255: return bytes([0x0F, n])
+        if n <= 32767: return b'\x1c' + struct.pack('<h', n)
+    val = float(m.group(0).rstrip('#!'))
+    if suffix == '#' or len(digits.replace('.', '').lstrip('0')) > 7:
+        return b'\x1f' + mbf.float_to_mbf64(val)
+    return b'\x1d' + mbf.float_to_mbf32(val)
+
+def tokenize_line(text, keywords=None):
+    """Tokenize one line of BASIC TEXT (without its line number)"""
+    keywords = keywords or _keywords()
+    out, idx, line_ref = bytearray(), 0, False
+    while idx < len(text):
+        c = text[idx]
+        if c == '"':
+            end = text.find('"', idx + 1)
+            end = len(text) if end < 0 else end + 1
+            out += text[idx:end].encode('latin-1')
+            idx, line_ref = end, False
+            continue
+        if c == "'":
+            out += b':\x8f\xd9' + text[idx+1:].encode('latin-1')
+            break
+        m = _based.match(text, idx)
+        if m:
+            out += (b'\x0c' if m.group(1) == 'H' else b'\x0b') + \
+                   struct.pack('<H', int(m.group(2), 16 if m.group(1) == 'H' else 8) & 0xFFFF)
+            idx, line_ref = m.end(), False
+            continue
+        m = (c.isdigit() or (c == '.' and text[idx+1:idx+2].isdigit())) and _number.match(text, idx)
+        if m:
+            out += _number_bytes(m, line_ref)
+            idx = m.end()
+            continue
+        for kw, code in keywords:
+            if text.startswith(kw, idx):
+                idx += len(kw)
+                if kw == 'ELSE':  out += b':'         # always stored as :ELSE
+                if kw == 'WHILE': code += b'\xe9'     # ... and WHILE+
+                out += code
+                if kw == 'REM':
+                    out += text[idx:].encode('latin-1')
+                    idx = len(text)
+                line_ref = kw in _jumps
+                break
+        else:
+            out.append(ord(c))
+            idx += 1
+            line_ref = line_ref and c in ' ,'
+    return bytes(out)
+
+def _encrypt(body):
+    """Protect BODY, the inverse of bascat._Decryptor"""
+    tables = _encryption_tables()
+    return bytes( tables[pos % 143][b] for pos, b in enumerate(body) )
+
+def _encryption_tables(cache=[]):
+    if not cache:
+        cache.extend( bytes(t.index(c) for c in range(256)) for t in bascat._Decryptor.tables )
+    return cache
+
+def tokenize(lines, protected=False):
+    """Tokenize LINES, a sequence of (line number, text), into a whole
+       .BAS file, optionally PROTECTED."""
+    keywords = _keywords()
+    body, link = bytearray(), 0x126A
+    for lineno, text in lines:
+        tokens = tokenize_line(text, keywords)
+        link = (link + 5 + len(tokens)) & 0xFFFF or 0x126A  # never 0, that means EOF
+        body += struct.pack('<HH', link, lineno) + tokens + b'\x00'
+    body += b'\x00\x00\x1a'
+    return b'\xfe' + _encrypt(body) if protected else b'\xff' + bytes(body)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Synthetic programs
+_statements = [
+    'PRINT "HELLO, WORLD";A$',
+    'FOR I=1 TO 100 STEP 2',
+    'IF X>10000 THEN GOTO 1000',
+    'Y=LOG(X)*&H7FFF:ELSE RETURN',
+    'LOCATE 12,40:COLOR 14,1:PRINT USING "###.##";AMT#',
+    'ON K GOSUB 200,300,400',
+    'A$=MID$(B$,I,1)+CHR$(65+I MOD 26)',
+    'NEXT I',
+    'WHILE A$<"Z":\' loop',         # the comments come last, so long lines
+    'REM this is only a comment',   # ... can leave them out
+]
+
+def _float_text(rng):
+    return rng.choice([ f'{rng.uniform(-1000, 1000):.3f}', f'{rng.uniform(0, 1):.6f}',
+                        f'{rng.uniform(1, 9):.2f}E{rng.randrange(-30, 30)}', f'{rng.uniform(-1, 1):.12f}#' ])
+
+def synthetic_source(kind='mixed', seed=1):
+    """Endlessly generate lines of text for a synthetic program of KIND:
+       'mixed' statements, float-heavy 'floats' DATA lines, or 'long' lines
+       of many statements.  (Real GW-BASIC keeps DATA items as text, but 
+       these are tokenized as numbers to work the MBF decoding.)"""
+    rng = random.Random(seed)
+    while True:
+        if kind == 'floats':
+            yield 'DATA ' + ','.join(_float_text(rng) for _ in range(rng.randrange(4, 12)))
+        elif kind == 'long':
+            parts, size = [], 0
+            while size < 240:
+                parts.append(rng.choice(_statements[:-2]))
+                size += len(parts[-1]) + 1
+            yield ':'.join(parts)
+        else:
+            yield rng.choice(_statements)
+
+def synthetic_program(size, kind='mixed', protected=False, seed=1):
+    """Build a tokenized program of at least SIZE bytes from synthetic_source(KIND)"""
+    lines, total, lineno = [], 0, 10
+    keywords = _keywords()
+    for text in synthetic_source(kind, seed):
+        if total >= size: break
+        lines.append( (lineno, text) )
+        total += len(tokenize_line(text, keywords)) + 5
+        lineno = (lineno + 10) % 65530 or 10
+    return tokenize(lines, protected)
+
+def time_path(path, fname):
+    """Run decoder PATH over FNAME, returning (seconds, lines)"""
+    start = time.perf_counter()
+    lines = list(path(fname))
+    return time.perf_counter() - start, lines
+
+def bench_readers(size):
+    """Compare the decoding paths against gwbas_lines() on a file of SIZE bytes"""
+    data = synthetic_program(size)
+    with tempfile.NamedTemporaryFile(suffix='.bas', delete=False) as tf:
+        tf.write(data)
+    try:
+        mb = len(data) / (1024*1024)
+        base_secs, expected = time_path(bascat.gwbas_lines, tf.name)
+        for name, path in _decoders:
+            secs, lines = time_path(path, tf.name)
+            if lines != expected:
+                raise AssertionError(f'{name} output differs from gwbas_lines()!')
+            print(f'{name:>22}: {secs:7.3f}s  {mb/secs:7.2f} MB/s  {len(lines)/secs:10.0f} lines/s'
+                  f'  ({base_secs/secs:.1f}x)')
+    finally:
+        os.unlink(tf.name)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# The suite: every corpus flavor, plain and protected, through each
+# decoder, with the results as JSON so numbers can be tracked over time.
+_decoders = [ ('gwbas_lines', bascat.gwbas_lines),
+              ('gwbas_lines_fast', bascat.gwbas_lines_fast) ]
+
+def alloc_per_line(path, fname, sample=200):
+    """Average bytes allocated while decoding each of the first SAMPLE lines
+       of FNAME with PATH (the tracemalloc peak above the starting point)."""
+    tracemalloc.start()
+    try:
+        lines, total = path(fname), 0
+        for count in range(sample):
+            current = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            if next(lines, None) is None: break
+            total += tracemalloc.get_traced_memory()[1] - current
+        else:
+            count = sample
+        lines.close()
+        return total / max(count, 1)
+    finally:
+        tracemalloc.stop()
+
+def bench_suite(size, reps=3, label=None):
+    """Run every decoder on SIZE-byte programs of each flavor, plain and
+       protected.  Returns the results as a JSON-ready dict."""
+    results = []
+    for kind in ('mixed', 'floats', 'long'):
+        for protected in (False, True):
+            data = synthetic_program(size, kind, protected)
+            with tempfile.NamedTemporaryFile(suffix='.bas', delete=False) as tf:
+                tf.write(data)
+            try:
+                expected = None
+                for name, path in _decoders:
+                    secs = float('inf')
+                    for _ in range(reps):
+                        t, lines = time_path(path, tf.name)
+                        secs = min(secs, t)
+                    expected = expected or lines
+                    if lines != expected:
+                        raise AssertionError(f'{name} output differs from gwbas_lines()!')
+                    results.append({ 'corpus': kind, 'protected': protected, 'decoder': name,
+                                     'bytes': len(data), 'lines': len(lines), 'seconds': secs,
+                                     'mb_per_s': len(data) / (1024*1024) / secs,
+                                     'lines_per_s': len(lines) / secs,
+                                     'alloc_bytes_per_line': alloc_per_line(path, tf.name) })
+                    r = results[-1]
+                    print(f'{kind:>6} {"protected" if protected else "plain":>9} {name:>20}: '
+                          f'{r["mb_per_s"]:7.2f} MB/s {r["lines_per_s"]:10.0f} lines/s '
+                          f'{r["alloc_bytes_per_line"]:8.0f} B alloc/line')
+            finally:
+                os.unlink(tf.name)
+    return { 'label': label, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+             'python': platform.python_version(), 'machine': platform.machine(),
+             'size': size, 'reps': reps, 'results': results }
+
+def write_corpus(outdir, count, size, kind, protected):
+    """Write COUNT synthetic .BAS files of about SIZE bytes into OUTDIR"""
+    os.makedirs(outdir, exist_ok=True)
+    for n in range(count):
+        with open(os.path.join(outdir, f'SYN{n:05}.BAS'), 'wb') as f:
+            f.write(synthetic_program(size, kind, protected, seed=n))
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Load test: a stand-in listing server on localhost, serving one file
+# either through agwbas_lines() or by running the blocking decoder in
+# a thread, with many clients fetching at once.
+async def _serve_async(fname, reader, writer):
+    await reader.readline()
+    src = bascat.AsyncFileSource(fname)
+    try:
+        async for l in bascat.agwbas_lines(src):
+            writer.write(l.encode('latin-1') + b'\n')
+            await writer.drain()
+    finally:
+        src.close()
+        writer.close()
+
+async def _serve_thread(fname, reader, writer):
+    await reader.readline()
+    lines = await asyncio.get_running_loop().run_in_executor(None, list, bascat.gwbas_lines(fname))
+    for l in lines:
+        writer.write(l.encode('latin-1') + b'\n')
+        await writer.drain()
+    writer.close()
+
+async def _fetch(port):
+    """Fetch one listing, returning (time to first line, total time)"""
+    start = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b'LIST\n')
+    await writer.drain()
+    await reader.readline()
+    first = time.perf_counter() - start
+    await reader.read()
+    writer.close()
+    return first, time.perf_counter() - start
+
+async def _load(handler, fname, clients):
+    server = await asyncio.start_server(lambda r, w: handler(fname, r, w), '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        start = time.perf_counter()
+        results = await asyncio.gather(*[ _fetch(port) for _ in range(clients) ])
+        return time.perf_counter() - start, results
+
+def bench_load(size, clients):
+    """Serve a SIZE-byte listing to CLIENTS concurrent clients, both ways"""
+    with tempfile.NamedTemporaryFile(suffix='.bas', delete=False) as tf:
+        tf.write(synthetic_program(size))
+    try:
+        for name, handler in [ ('agwbas_lines', _serve_async), ('thread+gwbas_lines', _serve_thread) ]:
+            secs, results = asyncio.run(_load(handler, tf.name, clients))
+            firsts = sorted(r[0] for r in results)
+            totals = sorted(r[1] for r in results)
+            p95 = lambda xs: xs[int(len(xs)*0.95) - 1] if len(xs) > 1 else xs[0]
+            print(f'{name:>20}: {clients/secs:7.1f} req/s | first line p50 {statistics.median(firsts)*1000:8.1f}ms'
+                  f' p95 {p95(firsts)*1000:8.1f}ms | complete p50 {statistics.median(totals)*1000:8.1f}ms'
+                  f' p95 {p95(totals)*1000:8.1f}ms max {totals[-1]*1000:8.1f}ms')
+    finally:
+        os.unlink(tf.name)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Checks: the table-driven code against the simple versions it replaced,
+# on random inputs.  Each raises AssertionError on the first difference.
+def check_decrypt(trials, rng):
+    """Decrypt TRIALS random inputs, from random key positions, both a byte
+       at a time with decrypt1() and in pieces split at random places with
+       decrypt() (pieces both shorter and longer than the 143-byte cycle)"""
+    for trial in range(trials):
+        data = rng.randbytes(rng.randrange(2000))
+        start = rng.randrange(143)
+        ref = bascat._Decryptor(None, start)
+        expected = bytes(ref.decrypt1(b) for b in data)
+        dec, got, pos = bascat._Decryptor(None, start), bytearray(), 0
+        while pos < len(data):
+            n = rng.randrange(1, 10) if rng.random() < 0.5 else rng.randrange(1, 500)
+            got += dec.decrypt(bytearray(data[pos:pos+n]))
+            pos += n
+        if got != expected or dec.pos != ref.pos:
+            raise AssertionError(f'decrypt() differs from decrypt1() on trial {trial} '
+                                 f'({len(data)} bytes from position {start})')
+    print(f'decrypt: {trials} random inputs match decrypt1()')
+
+def _mbf_exact(data):
+    """The exact value of the MBF number in DATA (4 or 8 bytes), rounded
+       once to a float: the reference for the conversions"""
+    n, bits = int.from_bytes(data, 'little'), len(data) * 8 - 8
+    exp = n >> bits
+    if exp == 0: return 0.0
+    mant = (n & ((1 << (bits - 1)) - 1)) | (1 << (bits - 1))
+    val = fractions.Fraction(mant) * fractions.Fraction(2) ** (exp - 128 - bits)
+    return float(-val if (n >> (bits - 1)) & 1 else val)
+
+def _random_float(rng):
+    """a random float, well inside MBF's range"""
+    return rng.choice((-1, 1)) * rng.random() * 2.0 ** rng.randrange(-120, 120)
+
+def check_mbf(trials, rng):
+    """Check mbf.py: the decoders against the exact values of random MBF
+       numbers (so doubles read their exponent from the last byte, and 
+       round to nearest), round trips through the encoders, and the 
+       array conversions, with and without a record stride, against the
+       scalar ones"""
+    for trial in range(trials):
+        b32, b64 = rng.randbytes(4), rng.randbytes(8)
+        if mbf.mbf32_to_float(b32) != _mbf_exact(b32) or mbf.mbf64_to_float(b64) != _mbf_exact(b64):
+            raise AssertionError(f'MBF decoding is off for {b32.hex()} / {b64.hex()}')
+        if b32[3] and mbf.float_to_mbf32(mbf.mbf32_to_float(b32)) != b32:
+            raise AssertionError(f'MBF single {b32.hex()} does not survive a round trip')
+        x = _random_float(rng)
+        if mbf.mbf64_to_float(mbf.float_to_mbf64(x)) != x:
+            raise AssertionError(f'{x!r} does not survive a round trip through an MBF double')
+        y = mbf.mbf32_to_float(mbf.float_to_mbf32(x))
+        if abs(y - x) > abs(x) * 2.0 ** -24:
+            raise AssertionError(f'{x!r} comes back from an MBF single as {y!r}')
+    # the last byte is the exponent, whatever is in byte 3
+    if mbf.mbf64_to_float(bytes([0, 0, 0, 0x55, 0, 0, 0, 0x81])) != 1.0 + 0x55 * 2.0 ** -31:
+        raise AssertionError('MBF doubles take their exponent from the wrong byte')
+    print(f'mbf: {trials} random numbers decode exactly and survive round trips')
+    if mbf.np is None:
+        print('mbf: no numpy, so the array conversions are not checked')
+        return
+    for trial in range(trials // 10 + 1):
+        reclen, offset = rng.randrange(8, 24), rng.randrange(8)
+        buf = bytearray(rng.randbytes(rng.randrange(0, 400)))
+        for i in range(0, len(buf), rng.randrange(3, 7)):
+            buf[i] = 0            # plenty of zero exponents too
+        for size, to_float, array in ((4, mbf.mbf32_to_float, mbf.mbf32_array),
+                                      (8, mbf.mbf64_to_float, mbf.mbf64_array)):
+            for off, stride in ((0, None), (offset, reclen)):
+                step = stride or size
+                expected = [ to_float(bytes(buf[i:i+size])) for i in range(off, len(buf) - size + 1, step) ]
+                if array(bytes(buf), off, stride).tolist() != expected:
+                    raise AssertionError(f'mbf{size*8}_array differs from the scalar conversion '
+                                         f'(offset {off}, stride {stride}, {len(buf)} bytes)')
+    print(f'mbf: {trials // 10 + 1} random buffers convert as arrays like the scalar functions')
+
+def run_checks(trials, seed):
+    rng = random.Random(seed)
+    check_decrypt(trials, rng)
+    check_mbf(trials, rng)
+
+if __name__=='__main__':
+    import argparse
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd")
+    rd = sub.add_parser("readers", help="compare the decoding paths on one big file")
+    rd.add_argument("-s", dest="size", type=float, default=4.0, help="size of the synthetic file, in MB")
+    ld = sub.add_parser("load", help="load-test a local listing server, async vs. threaded")
+    ld.add_argument("-s", dest="size", type=float, default=0.1, help="size of the served file, in MB")
+    ld.add_argument("-c", dest="clients", type=int, default=50, help="number of concurrent clients")
+    st = sub.add_parser("suite", help="run every decoder over every corpus flavor")
+    st.add_argument("-s", dest="size", type=float, default=1.0, help="size of each synthetic file, in MB")
+    st.add_argument("-r", dest="reps", type=int, default=3, help="timing repetitions (the best is kept)")
+    st.add_argument("-l", dest="label", help="a label for this run, like a version number")
+    st.add_argument("-o", dest="output", help="write the results to this JSON file")
+    cp = sub.add_parser("corpus", help="write a directory of synthetic .BAS files")
+    cp.add_argument("outdir", help="where to put the files")
+    cp.add_argument("-n", dest="count", type=int, default=100, help="how many files")
+    cp.add_argument("-s", dest="size", type=float, default=20.0, help="size of each file, in KB")
+    cp.add_argument("-k", dest="kind", choices=['mixed', 'floats', 'long'], default='mixed', help="flavor of program")
+    cp.add_argument("-p", dest="protected", action="store_true", help="write protected files")
+    ck = sub.add_parser("check", help="check the fast paths against the reference versions on random inputs")
+    ck.add_argument("-n", dest="trials", type=int, default=500, help="random inputs per check")
+    ck.add_argument("-r", dest="seed", type=int, default=1, help="random seed")
+    args = parser.parse_args()
+    if args.cmd == "check":
+        run_checks(args.trials, args.seed)
+    elif args.cmd == "suite":
+        results = bench_suite(int(args.size * 1024 * 1024), args.reps, args.label)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=1)
+    elif args.cmd == "corpus":
+        write_corpus(args.outdir, args.count, int(args.size * 1024), args.kind, args.protected)
+    elif args.cmd == "load":
+        bench_load(int(args.size * 1024 * 1024), args.clients)
+    else:
+        bench_readers(int(getattr(args, "size", 4.0) * 1024 * 1024))
@@ -0,0 +1,119 @@
+# Microsoft Binary Format (MBF) floating-point numbers.
+#
+# GW-BASIC predates IEEE 754, and stores its numbers in MBF.  Both sizes
+# are little-endian, with the exponent in the last byte:
+#
+#   single (4 bytes):  [ 23-bit mantissa | sign | 8-bit exponent ]
+#   double (8 bytes):  [ 55-bit mantissa | sign | 8-bit exponent ]
+#
+# The mantissa has an implied leading 1 bit, and represents a value in
+# [0.5, 1).  The exponent is biased by 128, and an exponent of 0 means
+# the number is 0, whatever the other bits say.
+#
+# Every MBF single fits exactly in a python float.  Doubles carry 55 bits
+# of mantissa against the float's 52, so they are rounded to nearest.
+#
+# The *_array functions convert whole buffers at once with NumPy, which
+# is only needed if you call them.
+
+import math
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_u32 = struct.Struct('<I')
+_u64 = struct.Struct('<Q')
+
+def mbf32_to_float(data):
+    """Convert 4 bytes of MBF single to a float"""
+    n = _u32.unpack(data)[0]
+    exp = n >> 24
+    if exp == 0: return 0.0
+    val = math.ldexp((n & 0x7FFFFF) | 0x800000, exp - 128 - 24)
+    return -val if (n & 0x800000) else val
+
+def mbf64_to_float(data):
+    """Convert 8 bytes of MBF double to a float"""
+    n = _u64.unpack(data)[0]
+    exp = n >> 56
+    if exp == 0: return 0.0
+    val = math.ldexp((n & 0x7FFFFFFFFFFFFF) | 0x80000000000000, exp - 128 - 56)
+    return -val if (n & 0x80000000000000) else val
+
+def _split(x, bits):
+    """Break finite X into (sign, exponent byte, BITS-bit mantissa with the
+       leading 1), rounding the mantissa to nearest."""
+    if math.isnan(x) or math.isinf(x):
+        raise ValueError(f'MBF has no representation for {x}')
+    m, e = math.frexp(abs(x))
+    mant = round(m * (1 << bits))
+    if mant == (1 << bits):  # rounded up into the next power of 2
+        mant, e = mant >> 1, e + 1
+    if e + 128 > 255:
+        raise OverflowError(f'{x} is too large for MBF')
+    if e + 128 < 1:
+        return (0, 0, 0)     # underflows to 0
+    return (x < 0, e + 128, mant)
+
+def float_to_mbf32(x):
+    """Convert float X to 4 bytes of MBF single"""
+    if x == 0: return bytes(4)
+    sgn, exp, mant = _split(x, 24)
+    return _u32.pack((exp << 24) | (sgn << 23) | (mant & 0x7FFFFF))
+
+def float_to_mbf64(x):
+    """Convert float X to 8 bytes of MBF double"""
+    if x == 0: return bytes(8)
+    sgn, exp, mant = _split(x, 56)
+    return _u64.pack((exp << 56) | (sgn << 55) | (mant & 0x7FFFFFFFFFFFFF))
+
+def _strided(buf, dtype, offset, stride):
+    """View BUF as an array of DTYPE, starting at byte OFFSET and stepping
+       by STRIDE bytes (for fields of fixed-size records)."""
+    if np is None:
+        raise ImportError('the MBF array conversions need numpy')
+    size = np.dtype(dtype).itemsize
+    stride = stride or size
+    if len(buf) < offset + size:
+        return np.empty(0, dtype)
+    count = (len(buf) - offset - size) // stride + 1
+    return np.ndarray((count,), dtype, buffer=buf, offset=offset, strides=(stride,))
+
+def mbf32_array(buf, offset=0, stride=None):
+    """Convert the packed MBF singles in BUF to a float64 array.  OFFSET and
+       STRIDE pick a field out of fixed-size records."""
+    n = _strided(buf, '<u4', offset, stride)
+    exp = (n >> 24).astype(np.int32)
+    out = np.ldexp(((n & 0x7FFFFF) | 0x800000).astype(np.float64), exp - 128 - 24)
+    np.negative(out, out=out, where=(n & 0x800000) != 0)
+    out[exp == 0] = 0.0
+    return out
+
+def mbf64_array(buf, offset=0, stride=None):
+    """Convert the packed MBF doubles in BUF to a float64 array.  OFFSET and
+       STRIDE pick a field out of fixed-size records."""
+    n = _strided(buf, '<u8', offset, stride)
+    exp = (n >> np.uint64(56)).astype(np.int32)
+    mant = (n & np.uint64(0x7FFFFFFFFFFFFF)) | np.uint64(0x80000000000000)
+    out = np.ldexp(mant.astype(np.float64), exp - 128 - 56)
+    np.negative(out, out=out, where=(n & np.uint64(0x80000000000000)) != 0)
+    out[exp == 0] = 0.0
+    return out
+
+if __name__=='__main__':
+    import argparse
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+                                     description="print the MBF numbers in a raw data file")
+    parser.add_argument("data_file", help="the file of MBF numbers")
+    parser.add_argument("-d", dest="double", action="store_true", help="the numbers are doubles")
+    parser.add_argument("-o", dest="offset", type=int, default=0, help="byte offset of the first number")
+    parser.add_argument("-r", dest="reclen", type=int, help="record length, when the numbers are one field of each record")
+    args = parser.parse_args()
+    with open(args.data_file, 'rb') as f:
+        data = f.read()
+    convert = mbf64_array if args.double else mbf32_array
+    for v in convert(data, args.offset, args.reclen):
+        print(f'{v:E}')
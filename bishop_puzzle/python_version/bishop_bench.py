@@ -0,0 +1,211 @@
+# Times the bishop puzzle solver.
+#
+# Runs solve() a few times with its output thrown away, and reports the
+# best wall-clock time.  With -j, it also times solve_parallel() with each
+# number of processes, to see how the layer expansion scales.  With -s, it
+# lines other solvers up against solve(): the positions each one stores
+# (or, for ida, expands), its peak memory, and its time.
+#
+# With -a, it runs the whole SUITE of solvers and board sizes, each in a
+# fresh process, under a SolveStats hook, and prints (or with -o, saves as
+# JSON or CSV) the per-layer and per-function timings, how many of the
+# generated positions were repeats, and the peak RSS.
+
+import concurrent.futures as futures
+import contextlib
+import csv
+import inspect
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+   import resource
+except ImportError:
+   resource = None
+
+import bishop_puzzle
+
+SUITE_SIZES = [ (3, 6), (4, 5), (4, 6) ]
+SUITE_SOLVERS = [ 'bfs', 'compact', 'sym', 'bidir', 'astar' ]
+
+def peak_rss():
+   """The peak resident memory of this process in bytes, or None if the
+      platform can't say"""
+   if resource is None: return None
+   peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+   return peak if sys.platform == 'darwin' else peak * 1024
+
+class SolveStats():
+   """A hook for the solvers.  Pass it as hook= to solve(), solve_compact()
+      or solve_symmetric() to get each layer's size and time.  While it is
+      active (in a with block), it also wraps the move-generation functions
+      to count their calls and time, and counts the positions generated, so
+      each layer also records how many of those were repeats.  The function
+      times include the functions they call (next_moves includes 
+      legal_moves, which includes attack_mask).  canonical is only called
+      by the symmetric search."""
+   PHASES = [ (bishop_puzzle, 'next_moves'), (bishop_puzzle, 'legal_moves'),
+              (bishop_puzzle.Geometry, 'attack_mask'), (bishop_puzzle.Symmetries, 'canonical') ]
+
+   def __init__(self):
+      self.layers = []
+      self.phases = { name: [0, 0.0] for _, name in self.PHASES }
+      self.generated = 0
+      self._saved = []
+
+   def _wrap(self, name, fn):
+      counts = self.phases[name]
+      def timed(*args):
+         start = time.perf_counter()
+         result = fn(*args)
+         if name == 'legal_moves':
+            result = list(result)   # run the generator now, to time it
+            self.generated += len(result)
+         counts[0] += 1
+         counts[1] += time.perf_counter() - start
+         return result
+      return timed
+
+   def __enter__(self):
+      for owner, name in self.PHASES:
+         fn = getattr(owner, name)
+         self._saved.append( (owner, name, fn) )
+         setattr(owner, name, self._wrap(name, fn))
+      self._started = self._mark = time.perf_counter()
+      self._generated_mark = 0
+      return self
+
+   def __exit__(self, *exc):
+      for owner, name, fn in reversed(self._saved):
+         setattr(owner, name, fn)
+      self._saved = []
+      self.seconds = time.perf_counter() - self._started
+      return False
+
+   def layer(self, depth, kept):
+      """Called by the solver as each layer finishes, KEPT being its new
+         positions"""
+      now = time.perf_counter()
+      generated = self.generated - self._generated_mark
+      self.layers.append({ 'depth': depth, 'seconds': now - self._mark,
+                           'generated': generated, 'kept': kept,
+                           'repeats': generated - kept })
+      self._mark, self._generated_mark = now, self.generated
+
+   def summary(self):
+      """All of the numbers as one dict"""
+      kept = sum(lay['kept'] for lay in self.layers)
+      return { 'seconds': getattr(self, 'seconds', None),
+               'generated': self.generated,
+               'seen_hit_rate': (1 - kept / self.generated) if self.layers and self.generated else None,
+               'peak_rss': peak_rss(),
+               'phases': { name: { 'calls': calls, 'seconds': secs }
+                           for name, (calls, secs) in self.phases.items() },
+               'layers': self.layers }
+
+   def write(self, path):
+      """Save the summary to PATH: as JSON, or the layers as CSV if PATH
+         ends in .csv"""
+      with open(path, 'w', newline='') as out:
+         if path.endswith('.csv'):
+            writer = csv.DictWriter(out, ['depth', 'seconds', 'generated', 'kept', 'repeats'])
+            writer.writeheader()
+            writer.writerows(self.layers)
+         else:
+            json.dump(self.summary(), out, indent=2)
+
+def run_config(name, rows, cols):
+   """Solve the ROWS x COLS puzzle with solver NAME under a SolveStats, and
+      return its summary"""
+   bishop_puzzle.Board.setup(rows, cols)
+   solver = bishop_puzzle.solvers[name]
+   with contextlib.redirect_stdout(io.StringIO()), SolveStats() as stats:
+      if 'hook' in inspect.signature(solver).parameters:
+         positions = solver(hook=stats)
+      else:   # this solver has no layers to report
+         positions = solver()
+   summary = stats.summary()
+   summary.update(solver=name, size=f'{rows}x{cols}', positions=positions)
+   return summary
+
+def run_suite(sizes=SUITE_SIZES, names=SUITE_SOLVERS):
+   """run_config() for each of NAMES on each of SIZES, each in a process of
+      its own so the peak RSS figures don't carry over"""
+   results = []
+   for rows, cols in sizes:
+      for name in names:
+         with futures.ProcessPoolExecutor(1) as pool:
+            summary = pool.submit(run_config, name, rows, cols).result()
+         results.append(summary)
+         rss = summary['peak_rss']
+         hits = summary['seen_hit_rate']
+         print(f'{summary["size"]:>5} {name:>8}: {summary["positions"]:>9} positions, '
+               f'{summary["seconds"]:7.3f}s, '
+               f'legal_moves {summary["phases"]["legal_moves"]["seconds"]:7.3f}s, '
+               f'repeats {"   -" if hits is None else f"{hits:4.0%}"}, '
+               f'peak RSS {"-" if rss is None else f"{rss / 2**20:.1f} MB"}')
+   return results
+
+def write_suite(results, path):
+   """Save suite RESULTS to PATH: as JSON, or one CSV row per run if PATH
+      ends in .csv"""
+   with open(path, 'w', newline='') as out:
+      if path.endswith('.csv'):
+         fields = [ 'size', 'solver', 'positions', 'seconds', 'generated', 'seen_hit_rate', 'peak_rss' ]
+         phases = list(results[0]['phases']) if results else []
+         writer = csv.writer(out)
+         writer.writerow(fields + [ f'{name}_seconds' for name in phases ])
+         for res in results:
+            writer.writerow([ res[f] for f in fields ] + [ res['phases'][name]['seconds'] for name in phases ])
+      else:
+         json.dump(results, out, indent=2)
+
+def time_solve(reps, solver=bishop_puzzle.solve):
+   """Best time, in seconds, over REPS runs of SOLVER"""
+   best = float('inf')
+   for _ in range(reps):
+      start = time.perf_counter()
+      with contextlib.redirect_stdout(io.StringIO()):
+         solver()
+      best = min(best, time.perf_counter() - start)
+   return best
+
+def measure(solver):
+   """(SOLVER's position count, its peak traced memory in bytes)"""
+   tracemalloc.start()
+   try:
+      with contextlib.redirect_stdout(io.StringIO()):
+         nodes = solver()
+      return nodes, tracemalloc.get_traced_memory()[1]
+   finally:
+      tracemalloc.stop()
+
+if __name__ == '__main__':
+   import argparse
+   parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+   parser.add_argument("-r", dest="reps", type=int, default=5, help="how many times to solve")
+   parser.add_argument("-z", dest="size", default="4x5", help="board size, as ROWSxCOLS")
+   parser.add_argument("-s", dest="solvers", nargs='*', default=[], choices=list(bishop_puzzle.solvers.keys()),
+                       help="solvers to compare with the bfs one")
+   parser.add_argument("-a", dest="suite", action="store_true", help="run the benchmark suite instead")
+   parser.add_argument("-o", dest="output", help="with -a, save the results here (.json or .csv)")
+   parser.add_argument("-j", dest="jobs", type=int, nargs='*', default=[], help="process counts to time solve_parallel() with")
+   args = parser.parse_args()
+   if args.suite:
+      results = run_suite()
+      if args.output: write_suite(results, args.output)
+      sys.exit(0)
+   bishop_puzzle.Board.setup(*map(int, args.size.lower().split('x')))
+   base = time_solve(args.reps)
+   print(f'solve(): {base:.3f}s (best of {args.reps})')
+   for jobs in args.jobs:
+      secs = time_solve(args.reps, lambda: bishop_puzzle.solve_parallel(jobs=jobs))
+      print(f'solve_parallel(jobs={jobs}): {secs:.3f}s, {base / secs:.2f}x')
+   for name in (['bfs'] + args.solvers if args.solvers else []):
+      solver = bishop_puzzle.solvers[name]
+      nodes, peak = measure(solver)
+      secs = time_solve(args.reps, solver)
+      print(f'{name:>8}: {nodes:>9} positions, {peak / 2**20:7.1f} MB peak, {secs:7.3f}s')
@@ -1,10 +1,71 @@
-sign = lambda v: (1,-1)[v < 0]
-import copy
+from array import array
+
+class Geometry():
+   """ The fixed move tables for a ROWS x COLS board, built once per size.
+       Square s = y*cols + x is bit s of a bitboard.  rays[s] holds the four
+       diagonal rays out of s (up-left, down-right, down-left, up-right), 
+       each as (mask, nearest, stops, full):
+          mask    : every square on the ray
+          nearest : picks the blocker closest to s out of (occupied & mask)
+          stops   : for each possible first blocker, the (bit, (x,y)) squares
+                    reachable before it
+          full    : the reachable squares when nothing blocks
+       The squares are listed in bishop_foreach order, so the up-left and 
+       down-left rays run toward s.  diagonals[s] is the mask of all four,
+       and coords[s] is (x,y). """
+   _cache = {}
+
+   @classmethod
+   def get(cls, rows, cols):
+      geo = cls._cache.get((rows, cols))
+      if geo is None:
+         geo = cls._cache[(rows, cols)] = cls(rows, cols)
+      return geo
+
+   def __init__(self, rows, cols):
+      self.rows, self.cols, self.squares = rows, cols, rows*cols
+      self.rays, self.diagonals = [], []
+      self.coords = [ (s % cols, s // cols) for s in range(self.squares) ]
+      lowest = lambda m: m & -m
+      highest = lambda m: 1 << (m.bit_length() - 1)
+      for s in range(self.squares):
+         cx, cy = s % cols, s // cols
+         rays = []
+         for dx, dy in ((-1,-1), (1,1), (-1,1), (1,-1)):
+            steps, x, y = [], cx+dx, cy+dy
+            while 0 <= x < cols and 0 <= y < rows:
+               steps.append( (1 << (y*cols + x), (x,y)) )
+               x, y = x+dx, y+dy
+            order = (lambda st: tuple(reversed(st))) if dx < 0 else tuple
+            stops = { bit: order(steps[:idx]) for idx, (bit, _) in enumerate(steps) }
+            rays.append( (sum(bit for bit, _ in steps), 
+                          lowest if (dy*cols + dx) > 0 else highest, 
+                          stops, order(steps)) )
+         self.rays.append(tuple(rays))
+         self.diagonals.append(sum(ray[0] for ray in rays))
+
+   def attack_mask(self, pieces):
+      """ the squares attacked by PIECES (diagonals don't get blocked) """
+      ap, diagonals = 0, self.diagonals
+      while pieces:
+         low = pieces & -pieces
+         ap |= diagonals[low.bit_length() - 1]
+         pieces ^= low
+      return ap
 
 class Board():
    ROWS = 4
    COLS = 5
-   
+
+   # A board is a pair of bitboards (white and black occupancy), with
+   # square s = y*COLS + x at bit s.  See Geometry.
+   @classmethod
+   def setup(cls, rows, cols):
+      """ size every board to ROWS x COLS """
+      cls.ROWS, cls.COLS = rows, cols
+      cls.SQUARES = rows * cols
+      cls.geometry = Geometry.get(rows, cols)
+
    @staticmethod
    def empty_places():
        result = []
@@ -12,23 +73,23 @@ class Board():
           result.append([0]*Board.COLS)
        return result
 
-   def __init__(self, places, prev=None, move=None):
-       self.places = places
+   def __init__(self, white, black, prev=None, move=None):
+       self.white = white
+       self.black = black
        self.prev = prev
        self.move = move
-       self.hash_code = Board.compute_hash(places)
-
-   def compute_attacks(self):
-       ap = Board.empty_places()
-       p = 0
-       def set_ap(dx,dy):
-          ap[dy][dx] |= p
-       for y in range(Board.ROWS):
-         for x in range(Board.COLS):
-           p = self.places[y][x]
-           if p > 0:
-             Board.bishop_foreach(x,y,set_ap)
-       self.attacked_places = ap
+       self.hash_code = white | (black << Board.SQUARES)
+
+   @classmethod
+   def from_places(cls, places, prev=None, move=None):
+       white, black = Board.masks(places)
+       return cls(white, black, prev, move)
+
+   @property
+   def places(self):
+       return [ [ (1 if self.white >> (y*Board.COLS + x) & 1 else 
+                   2 if self.black >> (y*Board.COLS + x) & 1 else 0) 
+                  for x in range(Board.COLS) ] for y in range(Board.ROWS) ]
 
    def __hash__(self):
        return self.hash_code
@@ -42,28 +103,6 @@ class Board():
           x1,y1,x2,y2 = self.move
           print(f'{Board.desc_square(x1,y1)} -> {Board.desc_square(x2,y2)}', end='\n\n')
 
-   def attacked(self, x, y, p):
-      """ tells if a piece p is attacked at (x,y) """
-      return (self.attacked_places[y][x] & (3-p)) != 0
-
-   def try_move(self, x1, y1, x2, y2):
-      """returns a new board if the move is legal"""
-      p = self.places[y1][x1]
-      if (not self.attacked(x2, y2, p)) and self.clear_path(x1,y1,x2,y2):
-          places = copy.deepcopy(self.places)
-          places[y1][x1], places[y2][x2] = 0, p
-          return Board(places,self,(x1,y1,x2,y2))
-      return None
-
-   def clear_path(self, x1, y1, x2, y2):
-      """ tells if the path between (x1,y1) and (x2,y2) is clear """
-      xdir, ydir = sign(x2-x1), sign(y2-y1)
-      x,y = x1, y1
-      while x != x2:
-         x, y = x+xdir, y+ydir
-         if self.places[y][x] != 0:  return False
-      return True
-
    @staticmethod
    def desc_square(x,y):
       return "ABCDEFGHIJKL"[x] + str(y+1) 
@@ -79,13 +118,16 @@ class Board():
         print()
      print()
 
-   @staticmethod 
-   def compute_hash(places):
-     hash = 0
+   @staticmethod
+   def masks(places):
+     """ the (white, black) bitboards for a list-of-lists board """
+     white, black, bit = 0, 0, 1
      for row in places:
         for val in row:
-            hash = (hash << 2) | (val & 3)
-     return hash
+            if val == 1: white |= bit
+            elif val == 2: black |= bit
+            bit <<= 1
+     return white, black
 
    @staticmethod
    def bishop_foreach(cx, cy, doit):
@@ -100,20 +142,39 @@ class Board():
          if x != cx: doit(x,y)
          x, y = x + 1, y - 1
 
+Board.setup(Board.ROWS, Board.COLS)
+
+def legal_moves(white, black):
+   """ generates (white, black, move) for each board one legal move away """
+   occupied = white | black
+   geo = Board.geometry
+   rays, coords = geo.rays, geo.coords
+   white_attacks, black_attacks = geo.attack_mask(white), geo.attack_mask(black)
+   pieces = occupied
+   while pieces:
+      bit = pieces & -pieces
+      pieces ^= bit
+      s = bit.bit_length() - 1
+      is_white = white & bit
+      enemy_attacks = black_attacks if is_white else white_attacks
+      here = coords[s]
+      for mask, nearest, stops, full in rays[s]:
+         # walk out to the first blocker
+         blocked = occupied & mask
+         reach = stops[nearest(blocked)] if blocked else full
+         for tbit, there in reach:
+            if enemy_attacks & tbit: continue
+            if is_white: yield white ^ bit ^ tbit, black, here + there
+            else:        yield white, black ^ bit ^ tbit, here + there
+
 def next_moves(board, seen):
-   x,y,p = 0,0,0
    moves = [] 
-   board.compute_attacks()
-   def gen_move(x2,y2):
-      nb = board.try_move(x,y,x2,y2)
-      if (nb is not None) and (nb.hash_code not in seen):
-         seen.add(nb.hash_code)
-         moves.append(nb)
-   for y in range(Board.ROWS):
-      for x in range(Board.COLS):
-          p = board.places[y][x]
-          if p != 0:
-            Board.bishop_foreach(x,y,gen_move)
+   squares = Board.SQUARES
+   for nw, nb, move in legal_moves(board.white, board.black):
+      nb_hash = nw | (nb << squares)
+      if nb_hash not in seen:
+         seen.add(nb_hash)
+         moves.append(Board(nw, nb, board, move))
    return moves
  
 
@@ -124,16 +185,22 @@ def make_initial_places():
       pl[y][-1] = 2 
    return pl
 
-def make_winning_places():
-   pl = Board.empty_places()
-   for y in range(Board.ROWS):
-      pl[y][0]  = 2
-      pl[y][-1] = 1 
-   return pl
+def make_winning_places(places=None):
+   """ the goal for starting PLACES (by default, make_initial_places()): 
+       every bishop's colour swapped """
+   places = places or make_initial_places()
+   return [ [ (3 - p) if p else 0 for p in row ] for row in places ]
+
+def parse_layout(text):
+   """ places from a layout like 'W---B/W---B/W---B/W---B' """
+   return [ [ {'W': 1, 'B': 2}.get(c, 0) for c in row ] for row in text.upper().split('/') ]
 
-def solve():
-   initial_board = Board(make_initial_places())
-   winning_board = Board(make_winning_places())
+def solve(start=None, goal=None, hook=None):
+   """ breadth-first search from START to GOAL.  After each layer, a HOOK
+       (like bishop_bench.SolveStats) hears hook.layer(depth, new boards). """
+   start = start or make_initial_places()
+   initial_board = Board.from_places(start)
+   winning_board = Board.from_places(goal or make_winning_places(start))
 
    seen = set()
    seen.add(initial_board.hash_code)
@@ -145,11 +212,628 @@ def solve():
       iteration = iteration + 1
       backlog = [ nxt  for m in backlog  for nxt in next_moves(m,seen) ]
       print(f'{iteration}: Backlog is {len(backlog)} deep.')
+      if hook: hook.layer(iteration, len(backlog))
       winner = next(filter(lambda m: m == winning_board, backlog), None)
    while winner:
       winner.display()
       winner = winner.prev
    print(f'{len(seen)} boards considered.')
+   return len(seen)
+
+def display_path(path):
+   """ display a PATH of (hash, move) from the start, goal first like solve() """
+   mask = (1 << Board.SQUARES) - 1
+   board = None
+   for h, move in path:
+      board = Board(h & mask, h >> Board.SQUARES, board, move)
+   while board:
+      board.display()
+      board = board.prev
+
+def solve_bidirectional(start=None, goal=None):
+   """ breadth-first search from both the start and the goal, meeting in 
+       the middle.  Moves are reversible, so the backward search uses the
+       same move generator. """
+   squares = Board.SQUARES
+   mask = (1 << squares) - 1
+   start = start or make_initial_places()
+   ends = [ Board.from_places(start).hash_code, 
+            Board.from_places(goal or make_winning_places(start)).hash_code ]
+   # for each side: hash -> (parent hash, move from parent, depth)
+   parents = [ { ends[0]: (None, None, 0) }, { ends[1]: (None, None, 0) } ]
+   frontiers = [ [ends[0]], [ends[1]] ]
+   depths = [0, 0]
+   meet = ends[0] if ends[0] == ends[1] else None
+   iteration = 0
+   while (meet is None) and frontiers[0] and frontiers[1]:
+      iteration = iteration + 1
+      side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+      mine, theirs = parents[side], parents[1-side]
+      depth = depths[side] = depths[side] + 1
+      layer, best = [], None
+      for h in frontiers[side]:
+         for nw, nb, move in legal_moves(h & mask, h >> squares):
+            nxt = nw | (nb << squares)
+            if nxt in mine: continue
+            mine[nxt] = (h, move, depth)
+            layer.append(nxt)
+            # finish the layer, but keep the meeting point with the shortest total
+            if nxt in theirs and (best is None or theirs[nxt][2] < best[1]):
+               best = (nxt, theirs[nxt][2])
+      frontiers[side] = layer
+      print(f'{iteration}: {("Forward","Backward")[side]} frontier is {len(layer)} deep.')
+      if best: meet = best[0]
+   if meet is not None:
+      # start --> meet along the forward parents...
+      path, h = [], meet
+      while h is not None:
+         parent, move, _ = parents[0][h]
+         path.append( (h, move) )
+         h = parent
+      path.reverse()
+      # ... then meet --> goal, reversing the backward search's moves
+      h = meet
+      while parents[1][h][0] is not None:
+         parent, (x1,y1,x2,y2), _ = parents[1][h]
+         path.append( (parent, (x2,y2,x1,y1)) )
+         h = parent
+      display_path(path)
+   print(f'{len(parents[0])} boards considered forward, {len(parents[1])} backward.')
+   return len(parents[0]) + len(parents[1])
+
+class PackedTable():
+   """ An open-addressing hash table of packed board states (white | black
+       << SQUARES), kept in flat arrays of 64-bit words instead of as python
+       ints in a set.  States wider than 64 bits take several words per slot.
+       With VALUES, each state also maps to another state (say, its parent),
+       with 0 meaning none.  An all-zero slot is empty, which is fine since 
+       a board with no bishops is never searched. """
+   def __init__(self, bits, values=False, capacity=1 << 12):
+      self.words = max(1, (bits + 63) // 64)
+      self.values = values
+      self.count = 0
+      self._allocate(capacity)
+
+   def _allocate(self, capacity):
+      self.capacity, self.shift = capacity, 64 - (capacity.bit_length() - 1)
+      self.keys = array('Q', bytes(8 * capacity * self.words))
+      self.vals = array('Q', bytes(8 * capacity * self.words)) if self.values else None
+
+   def _split(self, state):
+      return [ (state >> (64*w)) & 0xFFFFFFFFFFFFFFFF for w in range(self.words) ]
+
+   def _join(self, arr, slot):
+      w = self.words
+      return sum( arr[slot*w + i] << (64*i) for i in range(w) )
+
+   def _find(self, state):
+      """ the slot holding STATE, or the empty slot where it would go """
+      keys, w, mask = self.keys, self.words, self.capacity - 1
+      slot = ((hash(state) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> self.shift
+      if w == 1:
+         while True:
+            k = keys[slot]
+            if k == state or k == 0: return slot
+            slot = (slot + 1) & mask
+      parts = self._split(state)
+      while True:
+         here = keys[slot*w : slot*w + w]
+         if here == array('Q', parts) or not any(here): return slot
+         slot = (slot + 1) & mask
+
+   def __contains__(self, state):
+      slot = self._find(state)
+      return any(self.keys[slot*self.words : (slot+1)*self.words])
+
+   def __len__(self):
+      return self.count
+
+   def get(self, state, default=None):
+      slot = self._find(state)
+      if not any(self.keys[slot*self.words : (slot+1)*self.words]): return default
+      return self._join(self.vals, slot) if self.values else state
+
+   def add(self, state, value=0):
+      """ add STATE (mapped to VALUE), returning False if it was already there """
+      slot = self._find(state)
+      w = self.words
+      if any(self.keys[slot*w : slot*w + w]): return False
+      self.keys[slot*w : slot*w + w] = array('Q', self._split(state))
+      if self.values:
+         self.vals[slot*w : slot*w + w] = array('Q', self._split(value))
+      self.count += 1
+      if self.count * 10 > self.capacity * 7:
+         self._grow()
+      return True
+
+   def _grow(self):
+      old_keys, old_vals, old_cap = self.keys, self.vals, self.capacity
+      self._allocate(old_cap * 2)
+      self.count = 0
+      w = self.words
+      for slot in range(old_cap):
+         if any(old_keys[slot*w : slot*w + w]):
+            state = sum( old_keys[slot*w + i] << (64*i) for i in range(w) )
+            value = sum( old_vals[slot*w + i] << (64*i) for i in range(w) ) if old_vals else 0
+            self.add(state, value)
+
+   @property
+   def nbytes(self):
+      return (self.keys.itemsize * len(self.keys)) * (2 if self.values else 1)
+
+def move_between(parent, child):
+   """ the (x1,y1,x2,y2) move that turns packed state PARENT into CHILD """
+   changed = parent ^ child
+   src = (changed & parent).bit_length() - 1
+   dst = (changed & child).bit_length() - 1
+   cols, squares = Board.COLS, Board.SQUARES
+   src, dst = src % squares, dst % squares
+   return (src % cols, src // cols, dst % cols, dst // cols)
+
+def solve_compact(start=None, goal=None, hook=None):
+   """ breadth-first search like solve(), but with the visited states and
+       their parents kept as packed integers in a PackedTable, and frontiers
+       as arrays, instead of as Board objects. """
+   squares = Board.SQUARES
+   mask = (1 << squares) - 1
+   start = start or make_initial_places()
+   first = Board.from_places(start).hash_code
+   target = Board.from_places(goal or make_winning_places(start)).hash_code
+   parents = PackedTable(2 * squares, values=True)
+   parents.add(first, 0)
+   wide = parents.words > 1
+   backlog = [ first ] if wide else array('Q', [ first ])
+   iteration = 0
+   found = (first == target)
+   while (not found) and backlog:
+      iteration = iteration + 1
+      layer = [] if wide else array('Q')
+      for h in backlog:
+         for nw, nb, _ in legal_moves(h & mask, h >> squares):
+            nxt = nw | (nb << squares)
+            if parents.add(nxt, h):
+               layer.append(nxt)
+               if nxt == target: found = True
+      backlog = layer
+      print(f'{iteration}: Backlog is {len(backlog)} deep.')
+      if hook: hook.layer(iteration, len(backlog))
+   if found:
+      path, h = [], target
+      while h:
+         parent = parents.get(h)
+         path.append( (h, move_between(parent, h) if parent else None) )
+         h = parent
+      display_path(reversed(path))
+   print(f'{len(parents)} boards considered, {parents.nbytes / len(parents):.1f} bytes of table per board.')
+   return len(parents)
+
+def bishop_distances():
+   """ distances[s][t]: the fewest bishop moves from square s to square t
+       on an empty board (None when t is the other colour), found with a
+       breadth-first walk along bishop_foreach """
+   cols, squares = Board.COLS, Board.SQUARES
+   distances = []
+   for s in range(squares):
+      dist = [None] * squares
+      dist[s], layer = 0, [s]
+      while layer:
+         nxt = []
+         def visit(x, y, d=dist[layer[0]] + 1):
+            t = y*cols + x
+            if dist[t] is None:
+               dist[t] = d
+               nxt.append(t)
+         for t in layer:
+            Board.bishop_foreach(t % cols, t // cols, visit)
+         layer = nxt
+      distances.append(dist)
+   return distances
+
+class Heuristic():
+   """ A lower bound on the moves left to reach packed state GOAL: each 
+       move shifts one bishop, and each bishop needs at least as many 
+       moves as it takes to reach the nearest goal square of its colour on
+       an empty board.  The bound never drops by more than one per move,
+       so A* can close positions as soon as it expands them. """
+   def __init__(self, goal):
+      squares = Board.SQUARES
+      mask = (1 << squares) - 1
+      distances = bishop_distances()
+      def nearest(targets):
+         ends = [ t for t in range(squares) if targets >> t & 1 ]
+         return [ min((distances[s][t] for t in ends if distances[s][t] is not None),
+                      default=squares) for s in range(squares) ]
+      # the cost of every white and black bishop position, by bit of the state
+      self.costs = nearest(goal & mask) + nearest(goal >> squares)
+
+   def __call__(self, state):
+      costs, total = self.costs, 0
+      while state:
+         low = state & -state
+         total += costs[low.bit_length() - 1]
+         state ^= low
+      return total
+
+def solve_astar(start=None, goal=None):
+   """ A* search, guided by Heuristic, for a shortest path """
+   import heapq
+   squares = Board.SQUARES
+   mask = (1 << squares) - 1
+   start = start or make_initial_places()
+   first = Board.from_places(start).hash_code
+   target = Board.from_places(goal or make_winning_places(start)).hash_code
+   estimate = Heuristic(target)
+   # hash -> (parent hash, moves from the start)
+   parents = { first: (None, 0) }
+   closed = set()
+   # (bound on the total, -moves so far, hash): deeper positions first on ties
+   queue = [ (estimate(first), 0, first) ]
+   expanded, found = 0, False
+   while queue:
+      _, neg_g, h = heapq.heappop(queue)
+      if h in closed: continue
+      if h == target:
+         found = True
+         break
+      closed.add(h)
+      expanded += 1
+      g = 1 - neg_g
+      for nw, nb, _ in legal_moves(h & mask, h >> squares):
+         nxt = nw | (nb << squares)
+         known = parents.get(nxt)
+         if known is None or g < known[1]:
+            parents[nxt] = (h, g)
+            heapq.heappush(queue, (g + estimate(nxt), -g, nxt))
+   if found:
+      path, h = [], target
+      while h is not None:
+         parent = parents[h][0]
+         path.append( (h, move_between(parent, h) if parent is not None else None) )
+         h = parent
+      display_path(reversed(path))
+   print(f'{expanded} boards expanded.')
+   print(f'{len(parents)} boards considered.')
+   return len(parents)
+
+def solve_ida(start=None, goal=None, budget=1_000_000):
+   """ IDA* search: depth-first searches guided by Heuristic, with a bound
+       on the total path length that grows until one reaches the goal.  It
+       only keeps the current path, so it needs next to no memory, but it
+       revisits positions a lot, and gives up after BUDGET expansions. """
+   squares = Board.SQUARES
+   mask = (1 << squares) - 1
+   start = start or make_initial_places()
+   first = Board.from_places(start).hash_code
+   target = Board.from_places(goal or make_winning_places(start)).hash_code
+   estimate = Heuristic(target)
+   path, on_path = [ first ], { first }
+   expanded = 0
+
+   def search(g, bound):
+      """ the smallest total over BOUND seen below the end of PATH, or
+          None once the goal is found """
+      nonlocal expanded
+      h = path[-1]
+      f = g + estimate(h)
+      if f > bound: return f
+      if h == target: return None
+      if expanded >= budget: return float('inf')
+      expanded += 1
+      lowest = float('inf')
+      for nw, nb, _ in legal_moves(h & mask, h >> squares):
+         nxt = nw | (nb << squares)
+         if nxt in on_path: continue
+         path.append(nxt)
+         on_path.add(nxt)
+         result = search(g + 1, bound)
+         if result is None: return None
+         lowest = min(lowest, result)
+         on_path.discard(path.pop())
+      return lowest
+
+   bound = estimate(first)
+   while bound != float('inf'):
+      print(f'Bound {bound}: {expanded} boards expanded so far.')
+      bound = search(0, bound)
+      if bound is None: break
+   if bound is None:
+      display_path([ (path[0], None) ] + 
+                   [ (h, move_between(prev, h)) for prev, h in zip(path, path[1:]) ])
+   elif expanded >= budget:
+      print(f'Gave up after {budget} expansions.')
+   print(f'{expanded} boards expanded.')
+   return expanded
+
+def _owner(state, jobs):
+   """ which of JOBS shards of the visited set packed STATE belongs to """
+   return ((state * 0x9E3779B97F4A7C15) >> 40) % jobs
+
+def _pack(states, wide):
+   """ STATES ready to send down a pipe: as bytes of 64-bit words, unless 
+       they are too WIDE for that """
+   return states if wide else array('Q', states).tobytes()
+
+def _unpack(data, wide):
+   if wide: return data
+   states = array('Q')
+   states.frombytes(data)
+   return states
+
+def expand_worker(rows, cols, shard, jobs, conn):
+   """ one process of solve_parallel().  It owns SHARD of JOBS of the 
+       visited states (with their parents) and the part of the frontier in 
+       that shard, and answers commands from CONN:
+          ('seed', h)      : start the search from H, which is ours
+          ('has', h)       : send back whether H has been visited
+          ('expand', None) : send back the (child, parent) pairs one move 
+                             from the frontier, split up by shard
+          ('absorb', bufs) : keep the new children in BUFS as the next 
+                             frontier, and send back its size
+          ('parent', h)    : send back the parent of H
+          ('quit', None)   : stop """
+   Board.setup(rows, cols)
+   squares = Board.SQUARES
+   mask = (1 << squares) - 1
+   wide = 2*squares > 64
+   parents, frontier = {}, []
+   while True:
+      cmd, data = conn.recv()
+      if cmd == 'expand':
+         out = [ [] for _ in range(jobs) ]
+         for h in frontier:
+            for nw, nb, _ in legal_moves(h & mask, h >> squares):
+               nxt = nw | (nb << squares)
+               if nxt in parents: continue    # no need to ship our own repeats
+               bucket = out[_owner(nxt, jobs)]
+               bucket.append(nxt)
+               bucket.append(h)
+         conn.send([ _pack(bucket, wide) for bucket in out ])
+      elif cmd == 'absorb':
+         frontier = []
+         for buf in data:
+            pairs = _unpack(buf, wide)
+            for idx in range(0, len(pairs), 2):
+               nxt = pairs[idx]
+               if nxt not in parents:
+                  parents[nxt] = pairs[idx+1]
+                  frontier.append(nxt)
+         conn.send(len(frontier))
+      elif cmd == 'seed':
+         parents[data] = None
+         frontier = [ data ]
+      elif cmd == 'has':
+         conn.send(data in parents)
+      elif cmd == 'parent':
+         conn.send(parents[data])
+      else:
+         return
+
+def solve_parallel(start=None, goal=None, jobs=2):
+   """ breadth-first search like solve(), with each layer expanded by JOBS
+       processes.  The visited states are split between the processes by
+       hash, so each process weeds out the repeats in its own shard, and 
+       this one only passes the new states along to their owners. """
+   import multiprocessing as mult
+   squares = Board.SQUARES
+   start = start or make_initial_places()
+   first = Board.from_places(start).hash_code
+   target = Board.from_places(goal or make_winning_places(start)).hash_code
+   pipes, procs = [], []
+   for shard in range(jobs):
+      pcon, ccon = mult.Pipe()
+      proc = mult.Process(target=expand_worker, args=(Board.ROWS, Board.COLS, shard, jobs, ccon))
+      proc.start()
+      pipes.append(pcon)
+      procs.append(proc)
+   owner = lambda h: pipes[_owner(h, jobs)]
+   owner(first).send( ('seed', first) )
+   iteration, visited, deep = 0, 1, 1
+   found = (first == target)
+   while (not found) and deep:
+      iteration = iteration + 1
+      for p in pipes: p.send( ('expand', None) )
+      sent = [ p.recv() for p in pipes ]
+      for shard, p in enumerate(pipes):
+         p.send( ('absorb', [ bufs[shard] for bufs in sent ]) )
+      deep = sum(p.recv() for p in pipes)
+      visited += deep
+      print(f'{iteration}: Backlog is {deep} deep.')
+      owner(target).send( ('has', target) )
+      found = owner(target).recv()
+   if found:
+      path, h = [], target
+      while h is not None:
+         owner(h).send( ('parent', h) )
+         parent = owner(h).recv()
+         path.append( (h, move_between(parent, h) if parent is not None else None) )
+         h = parent
+      display_path(reversed(path))
+   for p in pipes: p.send( ('quit', None) )
+   for proc in procs: proc.join()
+   print(f'{visited} boards considered.')
+   return visited
+
+class Symmetries():
+   """ The symmetries of the puzzle that leave packed state FIRST alone.  
+       Flipping the board (and, on square boards, rotating or transposing
+       it) keeps bishop moves and attacks the same, and so does swapping 
+       the colours, so any of these that maps FIRST onto itself also maps
+       every position reachable from FIRST to one just as far away.  For 
+       the usual start that is the row flip, and the column flip with the
+       colours swapped, and the two together.  Each is kept as the bit each
+       state bit goes to, plus lookup tables to apply it a byte at a time.
+       With no FIRST, there are no symmetries and canonical() does nothing. """
+   def __init__(self, first=None):
+      rows, cols, squares = Board.ROWS, Board.COLS, Board.SQUARES
+      maps = [ lambda x,y: (cols-1-x, y), lambda x,y: (x, rows-1-y),
+               lambda x,y: (cols-1-x, rows-1-y) ]
+      if rows == cols:
+         maps += [ lambda x,y: (y, x), lambda x,y: (cols-1-y, rows-1-x),
+                   lambda x,y: (cols-1-y, x), lambda x,y: (y, rows-1-x) ]
+      maps.insert(0, lambda x,y: (x, y))
+      self.perms, self.tables = [], []
+      if first is None: return
+      for swap in (0, 1):
+         for fn in maps:
+            perm = []
+            for bit in range(2*squares):
+               colour, s = divmod(bit, squares)
+               x, y = fn(s % cols, s // cols)
+               perm.append( (colour ^ swap)*squares + y*cols + x )
+            if perm == list(range(2*squares)) or self.apply(perm, first) != first: continue
+            self.perms.append(perm)
+            self.tables.append([ [ sum(1 << perm[base+j] for j in range(8) 
+                                       if v >> j & 1 and base+j < len(perm)) 
+                                   for v in range(256) ]
+                                 for base in range(0, len(perm), 8) ])
+
+   @staticmethod
+   def apply(perm, state):
+      """ packed STATE with each bit moved where PERM says """
+      return sum(1 << perm[bit] for bit in range(len(perm)) if state >> bit & 1)
+
+   def canonical(self, state):
+      """ the smallest packed state symmetric to STATE """
+      best = state
+      for tables in self.tables:
+         other, shifted = 0, state
+         for table in tables:
+            other |= table[shifted & 255]
+            shifted >>= 8
+         if other < best: best = other
+      return best
+
+   def unfold(self, chain, goal):
+      """ turn a CHAIN of canonical states (the first being the start) into
+          a real path of packed states from the start to GOAL """
+      squares = Board.SQUARES
+      mask = (1 << squares) - 1
+      path = [ chain[0] ]
+      for c in chain[1:]:
+         h = path[-1]
+         path.append(next(nw | (nb << squares) for nw, nb, _ in legal_moves(h & mask, h >> squares)
+                          if self.canonical(nw | (nb << squares)) == c))
+      # the path ends on a symmetric image of GOAL, and the symmetry that
+      # undoes it leaves the start alone, so it takes the whole path to GOAL
+      if path[-1] != goal:
+         perm = next(p for p in self.perms if self.apply(p, goal) == path[-1])
+         inverse = [0] * len(perm)
+         for bit, to in enumerate(perm): inverse[to] = bit
+         path = [ self.apply(inverse, h) for h in path ]
+      return path
+
+def symmetric_search(first, target, symmetries, verbose=True, hook=None):
+   """ breadth-first search over one representative of each set of symmetric
+       positions.  Returns (path of packed states, or None, and the number 
+       of positions considered). """
+   squares = Board.SQUARES
+   mask = (1 << squares) - 1
+   canonical = symmetries.canonical
+   start, goal = canonical(first), canonical(target)
+   # canonical hash -> canonical parent
+   parents = { start: None }
+   backlog = [ start ]
+   iteration = 0
+   found = (start == goal)
+   while (not found) and backlog:
+      iteration = iteration + 1
+      layer = []
+      for h in backlog:
+         for nw, nb, _ in legal_moves(h & mask, h >> squares):
+            nxt = canonical(nw | (nb << squares))
+            if nxt not in parents:
+               parents[nxt] = h
+               layer.append(nxt)
+               if nxt == goal: found = True
+      backlog = layer
+      if verbose: print(f'{iteration}: Backlog is {len(backlog)} deep.')
+      if hook: hook.layer(iteration, len(backlog))
+   if not found: return None, len(parents)
+   chain, h = [], goal
+   while h is not None:
+      chain.append(h)
+      h = parents[h]
+   chain.reverse()
+   # the search began from the canonical start, not necessarily FIRST itself
+   chain[0] = first
+   return symmetries.unfold(chain, target), len(parents)
+
+def solve_symmetric(start=None, goal=None, hook=None):
+   """ breadth-first search like solve(), expanding each set of positions
+       that are mirror images of one another only once.  See Symmetries. """
+   start = start or make_initial_places()
+   first = Board.from_places(start).hash_code
+   target = Board.from_places(goal or make_winning_places(start)).hash_code
+   symmetries = Symmetries(first)
+   print(f'{len(symmetries.perms) + 1} symmetries of the start.')
+   path, count = symmetric_search(first, target, symmetries, hook=hook)
+   if path:
+      display_path([ (path[0], None) ] + 
+                   [ (h, move_between(prev, h)) for prev, h in zip(path, path[1:]) ])
+   print(f'{count} boards considered.')
+   return count
+
+def check_symmetric(start=None, goal=None):
+   """ solve with and without the symmetry reduction, and make sure the 
+       reduced search's path is legal and just as short """
+   start = start or make_initial_places()
+   first = Board.from_places(start).hash_code
+   target = Board.from_places(goal or make_winning_places(start)).hash_code
+   squares = Board.SQUARES
+   mask = (1 << squares) - 1
+   reduced, reduced_count = symmetric_search(first, target, Symmetries(first), False)
+   plain, plain_count = symmetric_search(first, target, Symmetries(), False)
+   for prev, h in zip(reduced or [], (reduced or [])[1:]):
+      if h not in { nw | (nb << squares) for nw, nb, _ in legal_moves(prev & mask, prev >> squares) }:
+         raise AssertionError(f'illegal move {move_between(prev, h)} in the reduced path')
+   if reduced and (reduced[0], reduced[-1]) != (first, target):
+      raise AssertionError('the reduced path does not run from the start to the goal')
+   moves = lambda path: path and len(path) - 1
+   if moves(reduced) != moves(plain):
+      raise AssertionError(f'the reduced search took {moves(reduced)} moves, the plain one {moves(plain)}')
+   result = f'take {moves(plain)} moves' if plain else 'find no solution'
+   print(f'Both searches {result}: {plain_count} boards plain, {reduced_count} reduced.')
+   return reduced_count
+
+solvers = {
+   'bfs': solve,
+   'bidir': solve_bidirectional,
+   'compact': solve_compact,
+   'sym': solve_symmetric,
+   'symcheck': check_symmetric,
+   'astar': solve_astar,
+   'ida': solve_ida,
+}
 
 if __name__ == '__main__':
-   solve()
+   import argparse
+   parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+   parser.add_argument("-s", dest="solver", choices=list(solvers.keys()), default="bfs", help="the search to use")
+   parser.add_argument("-r", dest="rows", type=int, default=Board.ROWS, help="rows on the board")
+   parser.add_argument("-c", dest="cols", type=int, default=Board.COLS, help="columns on the board")
+   parser.add_argument("-l", dest="layout", help="starting layout, rows split by '/', like W---B/W---B/W---B/W---B (overrides -r and -c)")
+   parser.add_argument("-g", dest="goal", help="goal layout (default: the start with the colours swapped)")
+   parser.add_argument("-m", dest="memory", action="store_true", help="trace and report peak memory")
+   parser.add_argument("-n", dest="budget", type=int, default=1_000_000, help="most positions the ida search may expand")
+   parser.add_argument("-j", "--jobs", dest="jobs", type=int, default=1, help="processes to expand each layer of the bfs search with")
+   args = parser.parse_args()
+   start = args.layout and parse_layout(args.layout)
+   if start:
+      Board.setup(len(start), len(start[0]))
+   else:
+      Board.setup(args.rows, args.cols)
+   goal = args.goal and parse_layout(args.goal)
+   if args.memory:
+      import tracemalloc
+      tracemalloc.start()
+   if args.jobs > 1:
+      if args.solver != 'bfs': parser.error('--jobs only works with the bfs search')
+      states = solve_parallel(start, goal, args.jobs)
+   elif args.solver == 'ida':
+      states = solve_ida(start, goal, args.budget)
+   else:
+      states = solvers[args.solver](start, goal)
+   if args.memory:
+      peak = tracemalloc.get_traced_memory()[1]
+      print(f'Peak memory {peak / 2**20:.1f} MB, {peak / max(states, 1):.0f} bytes per board '
+            f'({peak * 1e6 / max(states, 1) / 2**20:.1f} MB per million boards).')
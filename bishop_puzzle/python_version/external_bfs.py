@@ -0,0 +1,241 @@
+# External-memory breadth-first search for the bishop puzzle.
+#
+# For big boards the set of visited positions outgrows RAM, so this keeps
+# each layer of the search on disk instead: a file of packed states
+# (white | black << SQUARES), sorted, each a fixed number of bytes,
+# little-endian.  Since every move can be undone, a position one move past
+# layer d can only already be in layer d or d-1, so those two files are
+# all the next layer has to be checked against.
+#
+# Building a layer takes bounded memory: the successors of layer d are
+# collected CHUNK at a time, sorted into run files, and the runs are
+# merged with layers d and d-1 (read through mmap) in one streaming pass.
+#
+# After each layer, checkpoint.json in the work directory records how far
+# the search got, so rerunning the same command picks up from there.  Once
+# the goal turns up, the path is recovered backwards: each step looks for
+# a neighbour of the current position in the layer before, by binary
+# search on the mapped file.
+
+import heapq
+import json
+import mmap
+import os
+
+from bishop_puzzle import (Board, legal_moves, make_initial_places, make_winning_places,
+                           parse_layout, move_between, display_path)
+
+class LayerFile():
+   """ a sorted file of fixed-WIDTH packed states, read through mmap """
+   def __init__(self, path, width):
+      self.path, self.width = path, width
+      self.count = os.path.getsize(path) // width
+      self._file = open(path, 'rb')
+      self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.count else b''
+
+   def close(self):
+      if self.count: self._map.close()
+      self._file.close()
+
+   def __len__(self):
+      return self.count
+
+   def __getitem__(self, idx):
+      w = self.width
+      return int.from_bytes(self._map[idx*w : idx*w + w], 'little')
+
+   def __iter__(self):
+      w, mm = self.width, self._map
+      for pos in range(0, self.count * w, w):
+         yield int.from_bytes(mm[pos : pos + w], 'little')
+
+   def __contains__(self, state):
+      lo, hi = 0, self.count
+      while lo < hi:
+         mid = (lo + hi) // 2
+         if self[mid] < state: lo = mid + 1
+         else: hi = mid
+      return lo < self.count and self[lo] == state
+
+def write_states(path, states, width):
+   """ write the ascending STATES to PATH, WIDTH bytes each, through a
+       temporary file so a crash never leaves half a layer behind.  Returns
+       how many were written. """
+   count, batch = 0, []
+   with open(path + '.tmp', 'wb') as out:
+      for state in states:
+         batch.append(state.to_bytes(width, 'little'))
+         if len(batch) == 65536:
+            out.write(b''.join(batch))
+            count, batch = count + len(batch), []
+      out.write(b''.join(batch))
+      count += len(batch)
+   os.replace(path + '.tmp', path)
+   return count
+
+def _unique(states):
+   """ drop repeats from the ascending STATES """
+   last = None
+   for state in states:
+      if state != last:
+         yield state
+         last = state
+
+def _difference(states, *excluded):
+   """ the ascending STATES that are not in any of the EXCLUDED ascending
+       sequences """
+   heads = []
+   for seq in excluded:
+      it = iter(seq)
+      heads.append([next(it, None), it])
+   for state in states:
+      keep = True
+      for head in heads:
+         while head[0] is not None and head[0] < state:
+            head[0] = next(head[1], None)
+         if head[0] == state: keep = False
+      if keep: yield state
+
+class ExternalSearch():
+   """ The on-disk search from packed state FIRST toward TARGET, in
+       directory WORKDIR, holding at most CHUNK states in memory at once """
+   def __init__(self, first, target, workdir, chunk=1 << 20):
+      self.first, self.target = first, target
+      self.workdir, self.chunk = workdir, chunk
+      self.width = (2*Board.SQUARES + 7) // 8
+      os.makedirs(workdir, exist_ok=True)
+
+   def layer_path(self, depth):
+      return os.path.join(self.workdir, f'layer_{depth:04d}.bin')
+
+   def layer(self, depth):
+      return LayerFile(self.layer_path(depth), self.width)
+
+   @property
+   def checkpoint_path(self):
+      return os.path.join(self.workdir, 'checkpoint.json')
+
+   def load_checkpoint(self):
+      """ the checkpoint left by an earlier run of this same search, or None """
+      try:
+         with open(self.checkpoint_path) as f:
+            saved = json.load(f)
+      except FileNotFoundError:
+         return None
+      if (saved['rows'], saved['cols'], saved['first'], saved['target']) != \
+         (Board.ROWS, Board.COLS, self.first, self.target):
+         raise ValueError(f'{self.workdir} holds a different search; use another directory')
+      return saved
+
+   def save_checkpoint(self, depth, total, found):
+      with open(self.checkpoint_path + '.tmp', 'w') as f:
+         json.dump({ 'rows': Board.ROWS, 'cols': Board.COLS, 'first': self.first,
+                     'target': self.target, 'depth': depth, 'total': total,
+                     'found': found }, f)
+      os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+   def _runs(self, depth):
+      """ write the successors of layer DEPTH as sorted run files, CHUNK
+          states at a time, returning their paths """
+      squares = Board.SQUARES
+      mask = (1 << squares) - 1
+      paths, buf = [], []
+      def flush():
+         path = os.path.join(self.workdir, f'run_{depth:04d}_{len(paths):04d}.bin')
+         write_states(path, _unique(sorted(buf)), self.width)
+         paths.append(path)
+         buf.clear()
+      current = self.layer(depth)
+      try:
+         for h in current:
+            for nw, nb, _ in legal_moves(h & mask, h >> squares):
+               buf.append(nw | (nb << squares))
+            if len(buf) >= self.chunk: flush()
+      finally:
+         current.close()
+      if buf or not paths: flush()
+      return paths
+
+   def expand(self, depth):
+      """ build layer DEPTH+1 from the layers at DEPTH and DEPTH-1,
+          returning its size """
+      run_paths = self._runs(depth)
+      runs = [ LayerFile(path, self.width) for path in run_paths ]
+      older = [ self.layer(d) for d in (depth, depth - 1) if d >= 0 ]
+      try:
+         fresh = _difference(_unique(heapq.merge(*runs)), *older)
+         count = write_states(self.layer_path(depth + 1), fresh, self.width)
+      finally:
+         for lf in runs + older: lf.close()
+      for path in run_paths: os.remove(path)
+      return count
+
+   def run(self):
+      """ search until the goal turns up or the layers run out, returning
+          (the goal's depth or None, the number of positions seen) """
+      saved = self.load_checkpoint()
+      if saved:
+         depth, total, found = saved['depth'], saved['total'], saved['found']
+         print(f'Resuming after layer {depth} ({total} boards so far).')
+      else:
+         depth, total = 0, write_states(self.layer_path(0), [self.first], self.width)
+         found = (self.first == self.target)
+         self.save_checkpoint(depth, total, found)
+      size = -1
+      while not found and size != 0:
+         size = self.expand(depth)
+         depth, total = depth + 1, total + size
+         last = self.layer(depth)
+         found = self.target in last
+         last.close()
+         self.save_checkpoint(depth, total, found)
+         print(f'{depth}: Backlog is {size} deep.')
+      return (depth if found else None), total
+
+   def path(self, depth):
+      """ the (hash, move) path from the start to the goal at DEPTH, found
+          by stepping back through the layer files """
+      squares = Board.SQUARES
+      mask = (1 << squares) - 1
+      path, h = [ (self.target, None) ], self.target
+      for d in range(depth - 1, -1, -1):
+         prev = self.layer(d)
+         try:
+            parent = next(nw | (nb << squares) for nw, nb, _ in legal_moves(h & mask, h >> squares)
+                          if (nw | (nb << squares)) in prev)
+         finally:
+            prev.close()
+         path[-1] = (h, move_between(parent, h))
+         path.append( (parent, None) )
+         h = parent
+      return list(reversed(path))
+
+def solve_external(start=None, goal=None, workdir='bishop_layers', chunk=1 << 20):
+   """ breadth-first search like solve(), with the layers kept in files
+       under WORKDIR.  See ExternalSearch. """
+   start = start or make_initial_places()
+   first = Board.from_places(start).hash_code
+   target = Board.from_places(goal or make_winning_places(start)).hash_code
+   search = ExternalSearch(first, target, workdir, chunk)
+   depth, total = search.run()
+   if depth is not None:
+      display_path(search.path(depth))
+   print(f'{total} boards considered.')
+   return total
+
+if __name__ == '__main__':
+   import argparse
+   parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+   parser.add_argument("-d", dest="workdir", default="bishop_layers", help="directory for the layer files and checkpoint")
+   parser.add_argument("-k", dest="chunk", type=int, default=1 << 20, help="most successor states to sort in memory at once")
+   parser.add_argument("-r", dest="rows", type=int, default=Board.ROWS, help="rows on the board")
+   parser.add_argument("-c", dest="cols", type=int, default=Board.COLS, help="columns on the board")
+   parser.add_argument("-l", dest="layout", help="starting layout, rows split by '/' (overrides -r and -c)")
+   parser.add_argument("-g", dest="goal", help="goal layout (default: the start with the colours swapped)")
+   args = parser.parse_args()
+   start = args.layout and parse_layout(args.layout)
+   if start:
+      Board.setup(len(start), len(start[0]))
+   else:
+      Board.setup(args.rows, args.cols)
+   solve_external(start, args.goal and parse_layout(args.goal), args.workdir, args.chunk)
@@ -0,0 +1,164 @@
+# Benchmarks for the hill-climbing engine.
+#
+# Runs the same seeded search through the original hill_climb loop, which
+# crops, draws with PIL, and converts and measures the error of every
+# trial twice, and through the current numpy canvas engine, one shape at
+# a time and in batches.  It reports shapes tried per second (counting
+# the shapes each engine actually scored), the peak
+# memory traced while trying them (not counting what each engine sets up
+# beforehand), and the error reached.  The engines rasterize shapes
+# differently, so the errors only need to be close.
+#
+# With -j, it instead times the tiled mode of hillclimb_multi with each of
+# the given numbers of workers, to see how the throughput scales.
+
+import random
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import hillclimb
+import hillclimb_multi
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# The original PIL engine
+def legacy_random_shape(img, colors, func):
+    """draw a random ellipse into IMG in one of the color from COLORS"""
+    x,y = img.size
+    d = ImageDraw.Draw(img)
+    func(d,[0,0,x,y],random.choice(colors))
+    del d
+
+def legacy_draw_arc(d, bbox, color):
+    a1 = random.randrange(350)
+    a2 = random.randrange(a1+1, 360)
+    d.arc(bbox, a1, a2, fill=color)
+
+def legacy_draw_line(d,bbox,color):
+    if random.randrange(2) == 1:
+       bbox[0],bbox[2] = bbox[2], bbox[0]
+    d.line(bbox, width=random.randrange(1,3), fill=color),
+
+legacy_drawers = {
+  'filled_ellipse': lambda d,b,c: d.ellipse(b,fill=c),
+  'ellipse': lambda d,b,c: d.ellipse(b,outline=c),
+  'rectangle': lambda d,b,c: d.rectangle(b,outline=c),
+  'filled_rectangle': lambda d,b,c: d.rectangle(b,fill=c),
+  'line': legacy_draw_line,
+  'downleft_line': lambda d,b,c: d.line(b, width=random.randrange(1,3), fill=c),
+  'arc': legacy_draw_arc,
+}
+
+def legacy_hill_climb(img, tgtarr, colors, tries, drawfunc):
+    """hill_climb() as it was, recomputing the error of each crop twice
+       and of the whole image at the end"""
+    rms_err = hillclimb.rms_err
+    for _ in range(tries):
+        bbox = hillclimb.random_bbox(img)
+        scratch = img.crop(bbox)
+        subtgt  = tgtarr[ bbox[1]:bbox[3], bbox[0]:bbox[2], : ]
+        cur_err = rms_err(np.array(scratch, dtype=np.uint16), subtgt)
+        legacy_random_shape(scratch, colors, drawfunc)
+        new_err = rms_err(np.array(scratch, dtype=np.uint16), subtgt)
+        if new_err < cur_err:
+           img.paste(scratch,(bbox[0],bbox[1]))
+    best_err = rms_err(np.array(img, dtype=np.uint16), tgtarr)
+    return (img, best_err)
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class CountingTracker(hillclimb.ErrorTracker):
+    """An ErrorTracker that counts the shapes it scores, one at a time
+       (SINGLES) and in batches (BATCHED).  The batched engine scores the
+       shapes it accepts a second time, one at a time, so only BATCHED
+       counts its tries."""
+    singles = batched = 0
+
+    def shape_delta(self, shape, mask):
+        self.singles += 1
+        return super().shape_delta(shape, mask)
+
+    def batch_deltas(self, x0s, y0s, masks, colors):
+        self.batched += len(x0s)
+        return super().batch_deltas(x0s, y0s, masks, colors)
+
+def setup_legacy(tgt, shape, batch):
+    img = hillclimb.same_size_blank(tgt)
+    tgtarr, colors = np.asarray(tgt), hillclimb.get_colors(tgt)
+    return lambda tries: legacy_hill_climb(img, tgtarr, colors, tries, legacy_drawers[shape]) + (tries,)
+
+def setup_canvas(tgt, shape, batch):
+    canvas = hillclimb.Canvas.from_image(hillclimb.same_size_blank(tgt))
+    tracker = CountingTracker(canvas.arr, np.asarray(tgt))
+    colors = hillclimb.get_colors(tgt)
+    return lambda tries: hillclimb.hill_climb(canvas, tracker, colors, tries, shape) + (tracker.singles,)
+
+def setup_batched(tgt, shape, batch):
+    canvas = hillclimb.Canvas.from_image(hillclimb.same_size_blank(tgt))
+    tracker = CountingTracker(canvas.arr, np.asarray(tgt))
+    colors = hillclimb.get_colors(tgt)
+    return lambda tries: hillclimb.hill_climb_batched(canvas, tracker, colors, tries, shape, batch) + (tracker.batched,)
+
+# name -> function(target, shape, batch) returning a function(tries) that runs
+# the engine from a blank start, giving (image, error, shapes scored)
+engines = {
+  'legacy': setup_legacy,
+  'canvas': setup_canvas,
+  'batched': setup_batched,
+}
+
+def bench(tgt, tries, shape, seed, names, batch=256):
+    """time each of the engines NAMES on TRIES shapes from the same SEED,
+       returning {name: (shapes per second, peak bytes traced while trying
+       them, final error)}"""
+    results = {}
+    for name in names:
+        random.seed(seed)
+        run = engines[name](tgt, shape, batch)
+        start = time.perf_counter()
+        _, err, scored = run(tries)
+        secs = time.perf_counter() - start
+        random.seed(seed)
+        run = engines[name](tgt, shape, batch)
+        tracemalloc.start()
+        run(tries)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = (scored / secs, peak, err)
+        print(f"{name:>10}: {scored / secs:9.0f} shapes/s ({scored} scored), peak traced {peak / 1024:8.1f} KB, err {err:.4f}")
+    return results
+
+def scaling(tgt, each, shape, jobs, batch=256, grid=(8, 4), iters=5):
+    """time ITERS iterations of EACH shapes in the tiled mode of
+       hillclimb_multi with each number of workers in JOBS, returning
+       {workers: (shapes per second, final error)}"""
+    results = {}
+    for procs in jobs:
+        err, rate = hillclimb_multi.manage_tiles(tgt, hillclimb.same_size_blank(tgt), procs, iters,
+                                                 each, shape, batch, grid, save=False)
+        results[procs] = (rate, err)
+    base = results[jobs[0]][0]
+    for procs, (rate, err) in results.items():
+        print(f"{procs:>3} workers: {rate:9.0f} shapes/s, x{rate / base:5.2f}, err {err:.4f}")
+    return results
+
+if __name__=='__main__':
+  import argparse
+  parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("target", nargs='?', default="example.png", help="the target image to recreate")
+  parser.add_argument("-e", dest="each", type=int, default=5000, help="number of shapes to try")
+  parser.add_argument("-d", dest="shape", choices=list(hillclimb.drawers.keys()), default="filled_ellipse", help="the type of shape to draw")
+  parser.add_argument("-k", dest="batch", type=int, default=256, help="shapes per batch, for the batched engine")
+  parser.add_argument("-r", dest="seed", type=int, default=2018, help="random seed")
+  parser.add_argument("-b", dest="engines", nargs='*', choices=list(engines.keys()), default=list(engines.keys()), help="engines to time")
+  parser.add_argument("-j", dest="jobs", type=int, nargs='*', help="time the tiled hillclimb_multi with these numbers of workers (try 1 2 4 8)")
+  parser.add_argument("-t", dest="tiles", default="8x4", help="ACROSSxDOWN tiles, with -j")
+  args = parser.parse_args()
+
+  tgt = Image.open(args.target).convert('RGB')
+  if args.jobs:
+     grid = tuple(int(n) for n in args.tiles.lower().split('x'))
+     scaling(tgt, args.each, args.shape, args.jobs, args.batch, grid)
+  else:
+     bench(tgt, args.each, args.shape, args.seed, args.engines, args.batch)
@@ -0,0 +1,94 @@
+# Replay a shape log written by hillclimb.py or hillclimb_multi.py (-l).
+#
+# The log holds every shape the search kept, in order, so the picture can
+# be painted again at any scale, with lines and outlines thickened to
+# match, or written out as SVG.  At scale 1 it paints the same pixels the
+# search did.
+
+import numpy as np
+from PIL import Image
+
+from hillclimb import Canvas, read_shape_log, scaled_coverage
+
+def render(size, shapes, scale=1.0, start=None):
+    """paint SHAPES, logged on an image of SIZE, at SCALE times the size,
+       over the image START (resized to fit) or black.  Returns a Canvas."""
+    wid, ht = ( max(1, int(round(v * scale))) for v in size )
+    if start:
+       canvas = Canvas.from_image(start.resize((wid, ht), Image.LANCZOS))
+    else:
+       canvas = Canvas(np.zeros((ht, wid, 3), dtype=np.uint8))
+    for shape in shapes:
+        bbox, mask = scaled_coverage(shape, scale)
+        x0, y0, x1, y1 = bbox
+        # near the edges, rounding can push the scaled bbox past the image
+        mask = mask[:ht - y0, :wid - x0]
+        canvas.arr[y0:y1, x0:x1][mask] = shape.color
+    return canvas
+
+def svg_element(shape):
+    """the SVG for SHAPE, in the log's pixel coordinates"""
+    x0, y0, x1, y1 = shape.bbox
+    color = 'rgb({},{},{})'.format(*shape.color)
+    kind = shape.kind
+    cx, cy, rx, ry = (x0 + x1) / 2, (y0 + y1) / 2, (x1 - x0) / 2, (y1 - y0) / 2
+    if kind == 'filled_ellipse':
+        return f'<ellipse cx="{cx}" cy="{cy}" rx="{rx}" ry="{ry}" fill="{color}"/>'
+    if kind == 'filled_rectangle':
+        return f'<rect x="{x0}" y="{y0}" width="{x1-x0}" height="{y1-y0}" fill="{color}"/>'
+    # outlines run down the middle of the outermost pixels
+    stroke = f'fill="none" stroke="{color}"'
+    if kind == 'ellipse':
+        return f'<ellipse cx="{cx}" cy="{cy}" rx="{max(rx-0.5, 0)}" ry="{max(ry-0.5, 0)}" {stroke}/>'
+    if kind == 'rectangle':
+        return (f'<rect x="{x0+0.5}" y="{y0+0.5}" width="{max(x1-x0-1, 0)}" '
+                f'height="{max(y1-y0-1, 0)}" {stroke}/>')
+    if kind == 'arc':
+        a1, a2 = np.radians(shape.params)
+        rx, ry = max(rx - 0.5, 0), max(ry - 0.5, 0)
+        sx, sy = cx + rx * np.cos(a1), cy + ry * np.sin(a1)
+        ex, ey = cx + rx * np.cos(a2), cy + ry * np.sin(a2)
+        large = 1 if (a2 - a1) > np.pi else 0
+        return (f'<path d="M{sx:.2f},{sy:.2f} A{rx},{ry} 0 {large} 1 {ex:.2f},{ey:.2f}" '
+                f'{stroke}/>')
+    # lines
+    width, flipped = shape.params
+    lx0, lx1 = (x1 - 0.5, x0 + 0.5) if flipped else (x0 + 0.5, x1 - 0.5)
+    return (f'<line x1="{lx0}" y1="{y0+0.5}" x2="{lx1}" y2="{y1-0.5}" '
+            f'stroke="{color}" stroke-width="{width}"/>')
+
+def write_svg(path, size, shapes, scale=1.0, start=None):
+    """write SHAPES, logged on an image of SIZE, to PATH as an SVG SCALE
+       times the size, over a black background or the image file START"""
+    wid, ht = size
+    with open(path, 'w') as out:
+        out.write(f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                  f'width="{wid*scale:g}" height="{ht*scale:g}" viewBox="0 0 {wid} {ht}">\n')
+        if start:
+            out.write(f'<image xlink:href="{start}" x="0" y="0" width="{wid}" height="{ht}" '
+                      f'preserveAspectRatio="none"/>\n')
+        else:
+            out.write(f'<rect width="{wid}" height="{ht}" fill="black"/>\n')
+        for shape in shapes:
+            out.write(svg_element(shape))
+            out.write('\n')
+        out.write('</svg>\n')
+
+if __name__=='__main__':
+  import argparse
+  parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("log", help="the shape log to replay")
+  parser.add_argument("-o", dest="output", default="replay.png", help="the image to write (.svg for vectors)")
+  parser.add_argument("-x", dest="scale", type=float, default=1.0, help="how many times the search's size to render")
+  parser.add_argument("-s", dest="start", help="the image the search started from, if it wasn't blank")
+  parser.add_argument("-n", dest="count", type=int, help="only replay this many shapes")
+  args = parser.parse_args()
+
+  size, shapes = read_shape_log(args.log)
+  shapes = shapes[:args.count]
+  print(f"{len(shapes)} shapes on a {size[0]}x{size[1]} image")
+  if args.output.lower().endswith('.svg'):
+     write_svg(args.output, size, shapes, args.scale, args.start)
+  else:
+     start = args.start and Image.open(args.start).convert('RGB')
+     render(size, shapes, args.scale, start).to_image().save(args.output)
@@ -1,10 +1,26 @@
 # Image Hill-climbing 
 # Generates random ellipses and keeps the ones that make the image
 # closer to the given target, by RMSE. 
+#
+# The image is kept as a numpy array (a Canvas), and each shape is a
+# boolean coverage mask over its bounding box, so trying a shape only
+# looks at the pixels it covers, and PIL only gets involved to save.
+#
+# With -l, every shape kept is also appended to a small binary log, which
+# hc_replay.py can render again at any size, or as SVG.
+#
+# Snapshots are saved on a background thread, along with a checkpoint of
+# the whole state of the run, which -r picks up exactly where it left off.
 
+import functools
 import numpy as np
+import os
+import queue
 import random
-from PIL import Image, ImageDraw
+import struct
+import threading
+from collections import namedtuple
+from PIL import Image
 
 def rms_err(test, target):
     """determine the RMS Error between two arrays. N.B.: overwrites test"""
@@ -18,72 +34,541 @@ def get_colors(img):
     """pull the colors out of an image"""
     return [ c[1] for c in img.getcolors(img.size[0]*img.size[1]) ]
 
-def random_bbox(img):
-    """generate random bounding-box inside the img"""
+def random_bbox(img, region=None):
+    """generate random bounding-box inside the img (or inside REGION of it,
+       an [x0,y0,x1,y1) box at least 2 pixels on a side)"""
     x,y = img.size
-    ulx, uly = random.randrange(x-1), random.randrange(y-1)
+    rx0, ry0, rx1, ry1 = region or (0, 0, x, y)
+    ulx, uly = rx0 + random.randrange(rx1-rx0-1), ry0 + random.randrange(ry1-ry0-1)
     wid,ht = random.randrange(1, x // 10), random.randrange(1, y // 10)
-    return [ulx,uly,min(x,ulx+wid),min(uly+ht,y)]
+    return [ulx,uly,min(rx1,ulx+wid),min(uly+ht,ry1)]
 
-def random_shape(img, colors, func):
-    """draw a random ellipse into IMG in one of the color from COLORS"""
-    x,y = img.size
-    d = ImageDraw.Draw(img)
-    func(d,[0,0,x,y],random.choice(colors))
-    del d
-    
-def draw_arc(d, bbox, color):
+# A shape to draw: KIND is a key of drawers, BBOX is [x0,y0,x1,y1) on the
+# image, and PARAMS is whatever else the kind needs (angles, line width).
+Shape = namedtuple('Shape', 'kind bbox color params')
+
+def random_shape(img, colors, kind, region=None):
+    """a random SHAPE of KIND inside IMG (or REGION of it) in one of the
+       colors from COLORS"""
+    bbox = random_bbox(img, region)
+    return Shape(kind, bbox, random.choice(colors), drawers[kind][0]())
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Coverage masks: each takes the (height, width) of the bbox and the
+# shape's params, and gives a boolean array of the pixels covered.
+def _ellipse_coords(ht, wid):
+    """each pixel center, relative to the center of a HT x WID ellipse
+       and scaled by its radii"""
+    ys = (np.arange(ht) + 0.5 - ht / 2) / (ht / 2)
+    xs = (np.arange(wid) + 0.5 - wid / 2) / (wid / 2)
+    return ys[:, None], xs[None, :]
+
+def _border(mask, width=1):
+    """the pixels of MASK (or of each mask in a stack) within WIDTH steps
+       of a 4-neighbor outside it"""
+    inner = mask
+    for _ in range(width):
+        p = np.pad(inner, [(0,0)] * (mask.ndim - 2) + [(1,1), (1,1)])
+        inner = (p[...,1:-1,1:-1] & p[...,:-2,1:-1] & p[...,2:,1:-1] &
+                 p[...,1:-1,:-2] & p[...,1:-1,2:])
+    return mask & ~inner
+
+def filled_ellipse_mask(ht, wid, params):
+    ys, xs = _ellipse_coords(ht, wid)
+    return ys*ys + xs*xs <= 1.0
+
+def ellipse_mask(ht, wid, params):
+    return _border(filled_ellipse_mask(ht, wid, params))
+
+def filled_rectangle_mask(ht, wid, params):
+    return np.ones((ht, wid), dtype=bool)
+
+def rectangle_mask(ht, wid, params):
+    return _border(filled_rectangle_mask(ht, wid, params))
+
+def line_mask(ht, wid, params):
+    """a line corner to corner, upper-left to lower-right unless FLIPPED,
+       WIDTH pixels wide"""
+    width, flipped = params
+    mask = np.zeros((ht, wid), dtype=bool)
+    steps = max(ht, wid)
+    ys = np.rint(np.linspace(0, ht-1, steps)).astype(int)
+    xs = np.rint(np.linspace(0, wid-1, steps)).astype(int)
+    if flipped: xs = wid - 1 - xs
+    mask[ys, xs] = True
+    for _ in range(width - 1):
+       # thicken across the line's main direction
+       if wid >= ht: mask[1:, :] |= mask[:-1, :]
+       else: mask[:, 1:] |= mask[:, :-1]
+    return mask
+
+@functools.lru_cache(maxsize=1 << 12)
+def _arc_grid(ht, wid):
+    """the ellipse outline for a HT x WID bbox, and the angle of each pixel"""
+    ys, xs = _ellipse_coords(ht, wid)
+    return ellipse_mask(ht, wid, None), np.degrees(np.arctan2(ys, xs)) % 360
+
+def arc_mask(ht, wid, params):
+    """the part of the ellipse outline from angle A1 to A2, in degrees
+       clockwise from 3 o'clock"""
+    a1, a2 = params
+    outline, angles = _arc_grid(ht, wid)
+    return outline & (angles >= a1) & (angles <= a2)
+
+def no_params():
+    return None
+
+def arc_params():
     a1 = random.randrange(350)
-    a2 = random.randrange(a1+1, 360)
-    d.arc(bbox, a1, a2, fill=color)
-    
-def draw_line(d,bbox,color):
-    if random.randrange(2) == 1:
-       bbox[0],bbox[2] = bbox[2], bbox[0]
-    d.line(bbox, width=random.randrange(1,3), fill=color),
+    return (a1, random.randrange(a1+1, 360))
+
+def line_params():
+    return (random.randrange(1,3), random.randrange(2) == 1)
+
+def downleft_line_params():
+    return (random.randrange(1,3), False)
 
+# kind -> (function for random params, function for the coverage mask)
 drawers = {
-  'filled_ellipse': lambda d,b,c: d.ellipse(b,fill=c),
-  'ellipse': lambda d,b,c: d.ellipse(b,outline=c),
-  'rectangle': lambda d,b,c: d.rectangle(b,outline=c),
-  'filled_rectangle': lambda d,b,c: d.rectangle(b,fill=c),
-  'line': draw_line,
-  'downleft_line': lambda d,b,c: d.line(b, width=random.randrange(1,3), fill=c),
-  'arc': draw_arc,
+  'filled_ellipse': (no_params, filled_ellipse_mask),
+  'ellipse': (no_params, ellipse_mask),
+  'rectangle': (no_params, rectangle_mask),
+  'filled_rectangle': (no_params, filled_rectangle_mask),
+  'line': (line_params, line_mask),
+  'downleft_line': (downleft_line_params, line_mask),
+  'arc': (arc_params, arc_mask),
 }
 
-def hill_climb(img, tgtarr, colors, tries, drawfunc):
-    """Start from IMG, hill-climb toward TGTARR, 
-       using COLORS. Try adding shapes with DRAWFUNC TRIES times."""
+# the kinds in a fixed order, for numbering them in shape logs
+shape_kinds = ('filled_ellipse', 'ellipse', 'rectangle', 'filled_rectangle', 'line',
+               'downleft_line', 'arc')
+
+@functools.lru_cache(maxsize=1 << 14)
+def _coverage(kind, ht, wid, params):
+    mask = drawers[kind][1](ht, wid, params)
+    mask.flags.writeable = False
+    return mask
+
+def coverage(shape):
+    """the boolean mask of the pixels in SHAPE's bbox that it covers (shared;
+       don't modify it)"""
+    x0, y0, x1, y1 = shape.bbox
+    if shape.kind == 'arc':   # too many angles to be worth caching
+        return arc_mask(y1 - y0, x1 - x0, shape.params)
+    return _coverage(shape.kind, y1 - y0, x1 - x0, shape.params)
+
+def scaled_coverage(shape, scale):
+    """(the bbox, the coverage mask) of SHAPE drawn SCALE times as large,
+       with the lines and outlines thickened to match"""
+    x0, y0, x1, y1 = ( int(round(v * scale)) for v in shape.bbox )
+    bbox = [x0, y0, max(x1, x0 + 1), max(y1, y0 + 1)]
+    ht, wid, thick = bbox[3] - y0, bbox[2] - x0, max(1, int(round(scale)))
+    kind, params = shape.kind, shape.params
+    if kind in ('ellipse', 'rectangle', 'arc'):
+        filled = filled_rectangle_mask if kind == 'rectangle' else filled_ellipse_mask
+        mask = _border(filled(ht, wid, None), thick)
+        if kind == 'arc':
+            ys, xs = _ellipse_coords(ht, wid)
+            angles = np.degrees(np.arctan2(ys, xs)) % 360
+            mask &= (angles >= params[0]) & (angles <= params[1])
+        return bbox, mask
+    if kind in ('line', 'downleft_line'):
+        params = (params[0] * thick, params[1])
+    return bbox, drawers[kind][1](ht, wid, params)
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Batches: K random shapes at once, as arrays, with their masks stacked
+# into a (K, max height, max width) array, each in its top-left corner.
+# The rasterizers here must agree exactly with the single-shape ones.
+def max_bbox(size):
+    """the largest (height, width) random_bbox makes for an image of SIZE"""
+    x, y = size
+    return (max(1, y // 10 - 1), max(1, x // 10 - 1))
+
+def random_shapes(size, colors, kind, count, rng, region=None):
+    """COUNT random shapes of KIND, like random_shape would make, as a
+       tuple of arrays (x0, y0, x1, y1, color index into COLORS, params),
+       drawn from numpy generator RNG"""
+    x, y = size
+    rx0, ry0, rx1, ry1 = region or (0, 0, x, y)
+    ulx, uly = rng.integers(rx0, rx1-1, count), rng.integers(ry0, ry1-1, count)
+    wid, ht = rng.integers(1, x // 10, count), rng.integers(1, y // 10, count)
+    cidx = rng.integers(0, len(colors), count)
+    if kind == 'arc':
+        a1 = rng.integers(0, 350, count)
+        params = np.stack([a1, rng.integers(a1 + 1, 360)], axis=1)
+    elif kind in ('line', 'downleft_line'):
+        flipped = rng.integers(0, 2, count) if kind == 'line' else np.zeros(count, dtype=int)
+        params = np.stack([rng.integers(1, 3, count), flipped], axis=1)
+    else:
+        params = None
+    return (ulx, uly, np.minimum(rx1, ulx + wid), np.minimum(uly + ht, ry1), cidx, params)
+
+def shape_params(kind, params, k):
+    """the params of batch shape K in the form its kind's Shape uses"""
+    if params is None: return None
+    if kind == 'arc': return (int(params[k,0]), int(params[k,1]))
+    return (int(params[k,0]), bool(params[k,1]))
+
+def coverage_batch(kind, hts, wids, params, shape):
+    """the stacked masks of shapes of KIND with bbox heights HTS and widths
+       WIDS, in a (K,) + SHAPE array"""
+    mh, mw = shape
+    hts, wids = hts[:, None, None], wids[:, None, None]
+    yy, xx = np.arange(mh)[None, :, None], np.arange(mw)[None, None, :]
+    inside = (yy < hts) & (xx < wids)
+    if kind in ('filled_rectangle', 'rectangle'):
+        return inside if kind == 'filled_rectangle' else _border(inside)
+    if kind in ('filled_ellipse', 'ellipse'):
+        ys = (yy + 0.5 - hts / 2) / (hts / 2)
+        xs = (xx + 0.5 - wids / 2) / (wids / 2)
+        mask = inside & (ys*ys + xs*xs <= 1.0)
+        return mask if kind == 'filled_ellipse' else _border(mask)
+    # everything else is stacked up from the single-shape caches (for arcs,
+    # arctan2 over the whole batch costs more than the loop)
+    masks = np.zeros((len(hts), mh, mw), dtype=bool)
+    for k in range(len(hts)):
+        ht, wid = int(hts[k,0,0]), int(wids[k,0,0])
+        if kind == 'arc':
+            outline, angles = _arc_grid(ht, wid)
+            masks[k, :ht, :wid] = outline & (angles >= params[k,0]) & (angles <= params[k,1])
+        else:
+            masks[k, :ht, :wid] = _coverage(kind, ht, wid, shape_params(kind, params, k))
+    return masks
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Shape logs: a 10-byte header ('HCSL', format version, width, height), then
+# 16 bytes per shape: its kind's index in shape_kinds, its bbox, its color,
+# and two params (zeros, the arc's angles, or the line's width and flip).
+LOG_HEADER = struct.Struct('<4sHHH')
+LOG_RECORD = struct.Struct('<B4H3B2h')
+
+def pack_shape(shape):
+    """the log record for SHAPE"""
+    p1, p2 = shape.params or (0, 0)
+    return LOG_RECORD.pack(shape_kinds.index(shape.kind), *shape.bbox, *shape.color, p1, p2)
+
+def unpack_shape(record):
+    """the Shape in a log RECORD (a tuple from LOG_RECORD)"""
+    kind = shape_kinds[record[0]]
+    p1, p2 = record[8:]
+    params = (None if drawers[kind][0] is no_params else
+              (p1, p2) if kind == 'arc' else (p1, bool(p2)))
+    return Shape(kind, list(record[1:5]), record[5:8], params)
+
+def read_shape_log(path):
+    """the image (width, height) and the list of Shapes in the log at PATH.
+       A record cut short at the end, by a crash, is ignored."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, wid, ht = LOG_HEADER.unpack_from(data)
+    if magic != b'HCSL' or version != 1:
+        raise ValueError(f'{path} is not a shape log')
+    count = (len(data) - LOG_HEADER.size) // LOG_RECORD.size
+    body = memoryview(data)[LOG_HEADER.size : LOG_HEADER.size + count * LOG_RECORD.size]
+    return (wid, ht), [ unpack_shape(r) for r in LOG_RECORD.iter_unpack(body) ]
+
+class ShapeLog:
+    """An append-only log, at PATH, of the shapes kept on a canvas of
+       SIZE.  With APPEND, an existing log for the same size is continued
+       (the run should start from where that one left off), cut back to
+       AT bytes, if given, where a checkpoint left it; otherwise the file
+       starts over."""
+    def __init__(self, path, size, append=False, at=None):
+        self.path = path
+        if append and os.path.exists(path):
+            old_size, shapes = read_shape_log(path)
+            if old_size != tuple(size):
+                raise ValueError(f'{path} is a log for a {old_size[0]}x{old_size[1]} image')
+            end = LOG_HEADER.size + len(shapes) * LOG_RECORD.size
+            self.file = open(path, 'r+b')
+            self.file.truncate(end if at is None else min(at, end))
+            self.file.seek(0, os.SEEK_END)
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(LOG_HEADER.pack(b'HCSL', 1, *size))
+
+    def append(self, shape):
+        self.file.write(pack_shape(shape))
+
+    def extend(self, records):
+        """add RECORDS, already packed (say, by another process)"""
+        self.file.write(records)
+
+    def tell(self):
+        """the length of the log so far, in bytes"""
+        return self.file.tell()
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Checkpoints: everything needed to carry on a run exactly, in an .npz
+# file.  ITERATION is the next one to run, TILES is (0, 0) unless the run
+# was tiled, RNG_STATES holds random.getstate() for each process doing the
+# search, and LOG_OFFSET is how long the shape log was, or -1.
+Checkpoint = namedtuple('Checkpoint', 'canvas iteration err kind colors each batch tiles rng_states log_offset')
+
+def _save_whole(path, save):
+    """call SAVE on a file beside PATH, then move it over PATH, so what was
+       there is only replaced once the new one is complete"""
+    save(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+def write_checkpoint(path, ckpt):
+    """save the Checkpoint CKPT to PATH"""
+    keys = np.array([ st[1] for st in ckpt.rng_states ], dtype=np.uint32)
+    gauss = np.array([ np.nan if st[2] is None else st[2] for st in ckpt.rng_states ])
+    def save(tmp):
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, canvas=ckpt.canvas, iteration=ckpt.iteration, err=ckpt.err,
+                                kind=ckpt.kind, colors=np.array(ckpt.colors, dtype=np.uint8),
+                                each=ckpt.each, batch=ckpt.batch, tiles=np.array(ckpt.tiles),
+                                rng_version=np.array([ st[0] for st in ckpt.rng_states ]),
+                                rng_keys=keys, rng_gauss=gauss, log_offset=ckpt.log_offset)
+    _save_whole(path, save)
+
+def read_checkpoint(path):
+    """the Checkpoint saved at PATH"""
+    with np.load(path) as z:
+        states = [ (int(v), tuple(int(k) for k in keys), None if np.isnan(g) else float(g))
+                   for v, keys, g in zip(z['rng_version'], z['rng_keys'], z['rng_gauss']) ]
+        return Checkpoint(z['canvas'], int(z['iteration']), float(z['err']), str(z['kind']),
+                          [ tuple(int(v) for v in c) for c in z['colors'] ], int(z['each']),
+                          int(z['batch']), tuple(int(t) for t in z['tiles']), states,
+                          int(z['log_offset']))
+
+def write_png(path, arr):
+    """save the image array ARR to PATH as a PNG"""
+    img = Image.fromarray(arr, 'RGB')
+    _save_whole(path, lambda tmp: img.save(tmp, format='PNG'))
+
+class SnapshotWriter:
+    """Saves snapshots and checkpoints on a background thread, so the
+       search doesn't wait on PNG encoding and the disk.  What it is handed
+       is copied first, so the search can carry on changing it.  At most
+       BACKLOG saves wait their turn; past that, saving blocks.  A save
+       that fails is raised from the next call."""
+    def __init__(self, backlog=4):
+        self._jobs = queue.Queue(backlog)
+        self._failure = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None: break
+            try:
+                job[0](*job[1:])
+            except Exception as e:
+                self._failure = self._failure or e
+
+    def _put(self, *job):
+        if self._failure: raise self._failure
+        self._jobs.put(job)
+
+    def save_image(self, arr, path):
+        self._put(write_png, path, arr.copy())
+
+    def save_checkpoint(self, path, ckpt):
+        self._put(write_checkpoint, path, ckpt._replace(canvas=ckpt.canvas.copy()))
+
+    def close(self):
+        """finish the saves waiting, and stop"""
+        self._jobs.put(None)
+        self._thread.join()
+        if self._failure: raise self._failure
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class Canvas:
+    """The image being built, as a contiguous (height, width, 3) uint8
+       array.  It has a SIZE like a PIL image, so random_bbox works on it."""
+    def __init__(self, arr, copy=True):
+        self.arr = np.array(arr, dtype=np.uint8, order='C') if copy else arr
+        self.size = (self.arr.shape[1], self.arr.shape[0])
+
+    @classmethod
+    def from_image(cls, img):
+        return cls(np.asarray(img.convert('RGB')))
+
+    def to_image(self):
+        return Image.fromarray(self.arr, 'RGB')
+
+    def paint(self, shape, mask):
+        """draw SHAPE, with coverage MASK, in place"""
+        x0, y0, x1, y1 = shape.bbox
+        self.arr[y0:y1, x0:x1][mask] = shape.color
+
+class ErrorTracker:
+    """Keeps the squared error of every pixel of an image against TGTARR
+       (summed over the channels), and the total, so that trying a shape
+       only costs the pixels it covers, and the RMS error is always at
+       hand.
+
+       For scoring batches it also keeps four planes, with a margin of
+       max_bbox() on the bottom and right so a full-sized window can be
+       read at any corner: |target|^2 - error, and the target's three
+       channels.  Painting color C over pixels P then changes the total by
+           sum(|t|^2 - err) - 2 C.sum(t) + |P| |C|^2
+       which takes one masked sum per plane.
+
+       SHARED, if given, is the (error, planes) pair from the buffers of
+       another tracker for IMGARR, or copies of them (say, in shared
+       memory), to use rather than making new ones."""
+    def __init__(self, imgarr, tgtarr, shared=None):
+        ht, wid, chans = tgtarr.shape
+        mh, mw = max_bbox((wid, ht))
+        self.pixels = ht * wid * chans
+        self.tgtarr = np.asarray(tgtarr, dtype=np.int32)
+        self._tgt_sq = np.einsum('ijc,ijc->ij', self.tgtarr, self.tgtarr)
+        if shared is not None:
+            self.err, self._planes = shared
+            self.total = int(self.err.sum(dtype=np.int64))
+            return
+        self.err = np.empty((ht, wid), dtype=np.int32)
+        # int32 sums are safe unless a window could add up past 2**31
+        big = mh * mw * chans * 255 * 255 >= 2**31
+        self._planes = np.zeros((chans + 1, ht + mh, wid + mw), dtype=np.int64 if big else np.int32)
+        self._planes[1:, :ht, :wid] = self.tgtarr.transpose(2, 0, 1)
+        self.reset(imgarr)
+
+    @property
+    def buffers(self):
+        """the (error, planes) arrays, to share with another tracker"""
+        return self.err, self._planes
+
+    def reset(self, imgarr):
+        """start over from the whole image IMGARR"""
+        diff = np.subtract(imgarr, self.tgtarr, dtype=np.int32)
+        np.square(diff, out=diff)
+        diff.sum(axis=2, out=self.err)
+        self.total = int(self.err.sum(dtype=np.int64))
+        ht, wid = self.err.shape
+        self._planes[0, :ht, :wid] = self._tgt_sq - self.err
+
+    def shape_delta(self, shape, mask):
+        """(how much the total would change with SHAPE painted over its
+           coverage MASK, and the new error of the covered pixels)"""
+        x0, y0, x1, y1 = shape.bbox
+        diff = self.tgtarr[y0:y1, x0:x1][mask] - shape.color
+        new_err = np.einsum('ij,ij->i', diff, diff)
+        return int(new_err.sum()) - int(self.err[y0:y1, x0:x1][mask].sum()), new_err
+
+    def batch_deltas(self, x0s, y0s, masks, colors):
+        """how much the total would change with each of a batch of shapes
+           at corners (X0S, Y0S), with stacked coverage MASKS, painted in
+           COLORS (a (K, 3) array)"""
+        windows = np.lib.stride_tricks.sliding_window_view(self._planes, masks.shape[1:], axis=(1, 2))
+        sums = np.einsum('pkij,kij->kp', windows[:, y0s, x0s], masks).astype(np.int64)
+        colors = colors.astype(np.int64)
+        counts = masks.sum(axis=(1, 2))
+        return sums[:, 0] - 2 * np.einsum('kc,kc->k', sums[:, 1:], colors) + counts * np.einsum('kc,kc->k', colors, colors)
+
+    def accept(self, shape, mask, new_err, delta):
+        """record that SHAPE was painted, changing the total by DELTA"""
+        x0, y0, x1, y1 = shape.bbox
+        self.err[y0:y1, x0:x1][mask] = new_err
+        self._planes[0, y0:y1, x0:x1][mask] = self._tgt_sq[y0:y1, x0:x1][mask] - new_err
+        self.total += delta
+
+    @property
+    def rms(self):
+        return (self.total / self.pixels) ** 0.5
+
+def hill_climb(canvas, tracker, colors, tries, kind, region=None, log=None):
+    """Start from CANVAS, hill-climb toward the TRACKER's target,
+       using COLORS. Try adding shapes of KIND TRIES times (inside REGION,
+       if given), and append the ones kept to LOG, if given."""
     for _ in range(tries):
-        bbox = random_bbox(img)
-        scratch = img.crop(bbox)
-        subtgt  = tgtarr[ bbox[1]:bbox[3], bbox[0]:bbox[2], : ]
-        cur_err = rms_err(np.array(scratch, dtype=np.uint16), subtgt)
-        random_shape(scratch, colors, drawfunc)
-        new_err = rms_err(np.array(scratch, dtype=np.uint16), subtgt)
-        if new_err < cur_err:
-           img.paste(scratch,(bbox[0],bbox[1]))
-    best_err = rms_err(np.array(img, dtype=np.uint16), tgtarr)
-    return (img, best_err)
-
-def manage_work(tgt, best_img, iters, each, shape):
-    """Generate EACH random SHAPE at a time for ITERS iterations.  
-       Start from BEST_IMG and hill-climb toward TGT."""
-    random.seed()
-    drawfunc = drawers[shape]
-    tgtarr = np.asarray(tgt)
-    colors = get_colors(tgt)
-    best_err = rms_err(np.array(best_img, dtype=np.uint16), tgtarr)
-    print(f"Starting with an error of {best_err}")
+        shape = random_shape(canvas, colors, kind, region)
+        mask = coverage(shape)
+        delta, new_err = tracker.shape_delta(shape, mask)
+        if delta < 0:
+           canvas.paint(shape, mask)
+           tracker.accept(shape, mask, new_err, delta)
+           if log is not None: log.append(shape)
+    return (canvas, tracker.rms)
+
+def hill_climb_batched(canvas, tracker, colors, tries, kind, batch, region=None, log=None):
+    """Like hill_climb, but generate and score BATCH shapes at a time (the
+       last batch makes up the rest of the TRIES).  The improving shapes 
+       in each batch are taken best first, skipping any whose bbox overlaps
+       one already taken, since its score assumed the pixels underneath
+       hadn't changed."""
+    rng = np.random.default_rng(random.getrandbits(64))
+    palette = np.array(colors, dtype=np.int32)
+    mshape = max_bbox(canvas.size)
+    # shapes stay inside the region, so only its pixels need marking
+    rx0, ry0, rx1, ry1 = region or (0, 0) + canvas.size
+    taken = np.zeros((ry1 - ry0, rx1 - rx0), dtype=bool)
+    for start in range(0, tries, batch):
+        x0s, y0s, x1s, y1s, cidx, params = random_shapes(canvas.size, colors, kind, min(batch, tries - start),
+                                                         rng, region)
+        masks = coverage_batch(kind, y1s - y0s, x1s - x0s, params, mshape)
+        deltas = tracker.batch_deltas(x0s, y0s, masks, palette[cidx])
+        accepted = []
+        for k in np.argsort(deltas):
+            if deltas[k] >= 0: break
+            x0, y0, x1, y1 = int(x0s[k]), int(y0s[k]), int(x1s[k]), int(y1s[k])
+            spot = (slice(y0 - ry0, y1 - ry0), slice(x0 - rx0, x1 - rx0))
+            if taken[spot].any(): continue
+            taken[spot] = True
+            accepted.append(spot)
+            shape = Shape(kind, [x0, y0, x1, y1], colors[cidx[k]], shape_params(kind, params, k))
+            mask = masks[k, :y1-y0, :x1-x0]
+            delta, new_err = tracker.shape_delta(shape, mask)
+            canvas.paint(shape, mask)
+            tracker.accept(shape, mask, new_err, delta)
+            if log is not None: log.append(shape)
+        for spot in accepted:
+            taken[spot] = False
+    return (canvas, tracker.rms)
 
-    for counter in range(iters):
-       best_img, best_err = hill_climb(best_img, tgtarr, colors, each, drawfunc)
-       print(f"Iteration {counter} err is {best_err}")
-       if (counter % 10) == 0: 
-          best_img.save(f'out_{counter}.png')
+def manage_work(tgt, best_img, iters, each, shape, batch=1, log=None, checkpoint=None, resume=None):
+    """Generate EACH random SHAPE at a time for ITERS iterations.
+       Start from BEST_IMG and hill-climb toward TGT.  With BATCH over 1,
+       score that many shapes at once (see hill_climb_batched).  Record
+       the shapes kept in LOG, a ShapeLog, if given.  Every 10 iterations
+       and at the end, save a snapshot and, if CHECKPOINT is a path, a
+       checkpoint.  RESUME, a Checkpoint, carries on from it instead of
+       BEST_IMG, with its own SHAPE, EACH and BATCH."""
+    random.seed()
+    first, colors = 0, get_colors(tgt)
+    if resume:
+       first, shape, each, batch, colors = resume.iteration, resume.kind, resume.each, resume.batch, resume.colors
+       random.setstate(resume.rng_states[0])
+       canvas = Canvas(resume.canvas)
+    else:
+       canvas = Canvas.from_image(best_img)
+    tracker = ErrorTracker(canvas.arr, np.asarray(tgt))
+    print(f"Starting with an error of {tracker.rms}")
 
-    best_img.save(f'out_final.png')
+    writer = SnapshotWriter()
+    def snapshot(name, iteration):
+        writer.save_image(canvas.arr, f'out_{name}.png')
+        if checkpoint:
+           writer.save_checkpoint(checkpoint, Checkpoint(canvas.arr, iteration, tracker.rms, shape, colors,
+                                                         each, batch, (0, 0), [random.getstate()],
+                                                         log.tell() if log else -1))
+    try:
+       for counter in range(first, iters):
+          if batch > 1:
+             canvas, best_err = hill_climb_batched(canvas, tracker, colors, each, shape, batch, log=log)
+          else:
+             canvas, best_err = hill_climb(canvas, tracker, colors, each, shape, log=log)
+          print(f"Iteration {counter} err is {best_err}")
+          if log: log.flush()
+          if (counter % 10) == 0:
+             snapshot(counter, counter + 1)
+       snapshot('final', max(first, iters))
+    finally:
+       writer.close()
+    if log: log.close()
 
 if __name__=='__main__':
   import argparse
@@ -93,8 +578,15 @@ if __name__=='__main__':
   parser.add_argument("-i", dest="iterations", type=int, default=100, help="number of iterations to run")
   parser.add_argument("-e", dest="each", type=int, default=1000, help="number of shapes to try per iteration")
   parser.add_argument("-d", dest="shape", choices=list(drawers.keys()), default="filled_ellipse", help="the type of shape to draw")
+  parser.add_argument("-k", dest="batch", type=int, default=1, help="number of shapes to score at once")
+  parser.add_argument("-l", dest="log", help="append the shapes kept to this shape log (continuing it, with -s or -r)")
+  parser.add_argument("-c", dest="checkpoint", default="out_checkpoint.npz", help="where to save checkpoints ('' for nowhere)")
+  parser.add_argument("-r", dest="resume", help="checkpoint to resume from (in place of -s, -e, -d and -k)")
   args = parser.parse_args()
 
   myimg = Image.open(args.target).convert('RGB')
   starter = args.start and Image.open(args.start).convert('RGB') or same_size_blank(myimg)
-  manage_work(myimg, starter, args.iterations, args.each, args.shape)
+  resume = args.resume and read_checkpoint(args.resume)
+  log = args.log and ShapeLog(args.log, myimg.size, append=bool(args.start or resume),
+                              at=resume and resume.log_offset >= 0 and resume.log_offset or None)
+  manage_work(myimg, starter, args.iterations, args.each, args.shape, args.batch, log, args.checkpoint, resume)
@@ -6,151 +6,333 @@
 # finer points of the image, when far fewer ellipses actually
 # improve the image.  Until the starting point is fairly good,
 # extra processes do little to improve the outcome.
+#
+# The target and the best image so far are shared between the processes
+# in shared memory, so after each round the workers only report their 
+# errors, and the winner copies its image into the shared one.
+#
+# With --tiles, the workers cooperate instead of racing: see manage_tiles.
 
 import multiprocessing as mult
 import numpy as np
+import pickle
 import random
-from PIL import Image, ImageDraw
+import time
+from multiprocessing import shared_memory
+from PIL import Image
+
+from hillclimb import (same_size_blank, get_colors, drawers, hill_climb, hill_climb_batched,
+                       max_bbox, pack_shape, Canvas, ErrorTracker, ShapeLog, Checkpoint,
+                       SnapshotWriter, read_checkpoint)
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-# Need to be able to pickle and unpickle an image
-def pickle_img(img):
-    return { 'pixels': img.tobytes(), 'size': img.size, 'mode': img.mode }
+# The target and the best canvas so far live in shared memory, so the
+# pipes only carry error values and version numbers.
+def shared_array(arr):
+    """copy ARR into a new shared memory block, returning (block, view)"""
+    shm = shared_memory.SharedMemory(create=True, size=arr.nbytes)
+    view = np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)
+    view[...] = arr
+    return shm, view
+
+def attach_array(name, shape, dtype=np.uint8):
+    """the (block, view) of shared memory block NAME, made by shared_array"""
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+class MeteredPipe:
+    """A pipe connection that counts the bytes it sends and receives"""
+    def __init__(self, conn):
+        self.conn = conn
+        self.bytes = 0
 
-def unpickle_img(pickled):
-    return Image.frombytes(pickled['mode'], pickled['size'], pickled['pixels'])
+    def send(self, obj):
+        data = pickle.dumps(obj)
+        self.bytes += len(data)
+        self.conn.send_bytes(data)
+
+    def recv(self):
+        data = self.conn.recv_bytes()
+        self.bytes += len(data)
+        return pickle.loads(data)
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-def rms_err(test, target):
-    """determine the RMS Error between two arrays. N.B.: overwrites test"""
-    return np.sqrt(np.mean(np.square(np.subtract(test,target,out=test),out=test)))
-
-
-def same_size_blank(tgt, color=(0,0,0)):
-    """create an empty image of the same size as the tgt"""
-    return Image.new('RGB', tgt.size, color)
-
-def get_colors(img):
-    """pull the colors out of an image"""
-    return [ c[1] for c in img.getcolors(img.size[0]*img.size[1]) ]
-
-def random_bbox(img):
-    """generate random bounding-box inside the img"""
-    x,y = img.size
-    ulx, uly = random.randrange(x-1), random.randrange(y-1)
-    wid,ht = random.randrange(1, x // 10), random.randrange(1, y // 10)
-    return [ulx,uly,min(x,ulx+wid),min(uly+ht,y)]
-
-def random_shape(img, colors, func):
-    """draw a random ellipse into IMG in one of the color from COLORS"""
-    x,y = img.size
-    d = ImageDraw.Draw(img)
-    func(d,[0,0,x,y],random.choice(colors))
-    del d
-    
-def draw_arc(d, bbox, color):
-    a1 = random.randrange(350)
-    a2 = random.randrange(a1+1, 360)
-    d.arc(bbox, a1, a2, fill=color)
-    
-def draw_line(d,bbox,color):
-    if random.randrange(2) == 1:
-       bbox[0],bbox[2] = bbox[2], bbox[0]
-    d.line(bbox, width=random.randrange(1,3), fill=color),
-
-drawers = {
-  'filled_ellipse': lambda d,b,c: d.ellipse(b,fill=c),
-  'ellipse': lambda d,b,c: d.ellipse(b,outline=c),
-  'rectangle': lambda d,b,c: d.rectangle(b,outline=c),
-  'filled_rectangle': lambda d,b,c: d.rectangle(b,fill=c),
-  'line': draw_line,
-  'downleft_line': lambda d,b,c: d.line(b, width=random.randrange(1,3), fill=c),
-  'arc': draw_arc,
-}
-
-def hill_climb(img, tgtarr, colors, tries, drawfunc):
-    """Start from IMG, hill-climb toward TGTARR, 
-       using COLORS. Try adding shapes with DRAWFUNC TRIES times."""
-    for _ in range(tries):
-        bbox = random_bbox(img)
-        scratch = img.crop(bbox)
-        subtgt  = tgtarr[ bbox[1]:bbox[3], bbox[0]:bbox[2], : ]
-        cur_err = rms_err(np.array(scratch, dtype=np.uint16), subtgt)
-        random_shape(scratch, colors, drawfunc)
-        new_err = rms_err(np.array(scratch, dtype=np.uint16), subtgt)
-        if new_err < cur_err:
-           img.paste(scratch,(bbox[0],bbox[1]))
-    best_err = rms_err(np.array(img, dtype=np.uint16), tgtarr)
-    return (img, best_err)
-
-def hill_climb_worker(tgtp, mgr, each, start_img, start_err, shape):
-    """control a worker for image TGTP and pipe MGR. Start with START_IMG+START_ERR
-       and generate EACH SHAPEs at a time."""
-    # set up, and delete unneeded large objects
+def hill_climb_worker(tgt_name, best_name, shape_hw, colors, mgr, each, shape, batch=1, log=False,
+                      rng_state=None):
+    """control a worker for the target in shared memory TGT_NAME and pipe
+       MGR, starting from the canvas in BEST_NAME (and random state 
+       RNG_STATE, if given).  Generate EACH SHAPEs at a time, scoring BATCH
+       at once, and after each round tell MGR the error.  MGR answers with:
+          ('publish', err, version) : (maybe) we won; copy our canvas to 
+                                      BEST_NAME and answer with VERSION and
+                                      the packed shapes we added since our
+                                      canvas was last the best (if LOG)
+       then maybe:
+          ('checkpoint', err, version) : answer with our random state
+       and then one of:
+          ('sync', err, version)    : BEST_NAME holds canvas VERSION, with 
+                                      error ERR; take it if it's new to us
+                                      (the winner's error is never more 
+                                      than ours)
+          ('quit', 0, 0)            : done"""
     random.seed()
-    tgt = unpickle_img(tgtp)
-    del tgtp 
-    colors = get_colors(tgt)
-    tgtarr = np.asarray(tgt)
-    del tgt
-    img = unpickle_img(start_img)
-    del start_img
-    best_err = start_err
-    drawfunc = drawers[shape]
+    if rng_state: random.setstate(rng_state)
+    tgt_shm, tgtarr = attach_array(tgt_name, shape_hw)
+    best_shm, best = attach_array(best_name, shape_hw)
+    canvas = Canvas(best)
+    tracker = ErrorTracker(canvas.arr, tgtarr)
+    pending = [] if log else None
+    seen = 0
 
     # hill-climb and loop
     while True:
-        img, nerr = hill_climb(img, tgtarr, colors, each, drawfunc)
-        if nerr < best_err:
-           best_err = nerr
-           mgr.send( (pickle_img(img), best_err) )
+        if batch > 1:
+           canvas, nerr = hill_climb_batched(canvas, tracker, colors, each, shape, batch, log=pending)
         else:
-           mgr.send( (None, 999999) )
-        (nimg, n_err) = mgr.recv()
-        if n_err == 0:
-           return   # done!
-        if n_err < best_err:
-           img, best_err = unpickle_img(nimg), n_err
+           canvas, nerr = hill_climb(canvas, tracker, colors, each, shape, log=pending)
+        mgr.send(nerr)
+        (cmd, n_err, version) = mgr.recv()
+        if cmd == 'publish':
+           best[...] = canvas.arr
+           mgr.send( (version, b''.join(pack_shape(s) for s in pending or [])) )
+           seen = version
+           if log: pending.clear()
+           (cmd, n_err, version) = mgr.recv()
+        if cmd == 'checkpoint':
+           mgr.send(random.getstate())
+           (cmd, n_err, version) = mgr.recv()
+        if cmd == 'quit':
+           break   # done!
+        if version != seen:
+           canvas.arr[...] = best
+           tracker.reset(canvas.arr)
+           seen = version
+           if log: pending.clear()
+    del tgtarr, best
+    tgt_shm.close()
+    best_shm.close()
 
+def resume_settings(resume, procs, each, shape, batch, colors):
+    """the (first iteration, PROCS, EACH, SHAPE, BATCH, COLORS, worker 
+       random states) to run with: the ones given, or RESUME's, if it is a
+       Checkpoint"""
+    if not resume:
+       return 0, procs, each, shape, batch, colors, [None] * procs
+    if len(resume.rng_states) != procs:
+       print(f"Resuming with the checkpoint's {len(resume.rng_states)} jobs")
+    return (resume.iteration, len(resume.rng_states), resume.each, resume.kind, resume.batch,
+            resume.colors, resume.rng_states)
 
-def manage_workers(tgt, starting_point, procs, iters, each, shape):
+def manage_workers(tgt, starting_point, procs, iters, each, shape, batch=1, log=None, checkpoint=None,
+                   resume=None):
     """Create PROCS workers, each of which will generate EACH SHAPEs at
        a time for ITERS iterations.  Start from STARTING_POINT and hill-climb
-       towrad TGT."""
+       towrad TGT.  Record the shapes of each new best canvas in LOG, a 
+       ShapeLog, if given.  Every 10 iterations and at the end, save a
+       snapshot and, if CHECKPOINT is a path, a checkpoint.  RESUME, a 
+       Checkpoint, carries on from it instead of STARTING_POINT, with its
+       own PROCS, EACH, SHAPE and BATCH."""
     pipes = [] 
     jobs = []
-    ptgt = pickle_img(tgt)
-    best_img = pickle_img(starting_point)
-    best_err = rms_err(np.array(starting_point, dtype=np.uint16), np.asarray(tgt))
+    tgtarr = np.asarray(tgt)
+    first, procs, each, shape, batch, colors, states = resume_settings(resume, procs, each, shape,
+                                                                       batch, get_colors(tgt))
+    start = Canvas(resume.canvas) if resume else Canvas.from_image(starting_point)
+    best_err = ErrorTracker(start.arr, tgtarr).rms
     print(f"Starting with an error of {best_err}")
-    for jno in range(procs):
-       pcon, ccon = mult.Pipe()
-       pipes.append(pcon)
-       proc = mult.Process(target=hill_climb_worker,
-                           args=(ptgt, ccon, each, best_img, best_err, shape))
-       jobs.append(proc)
-       print(f"Created job {jno}")
-       proc.start()
-    for counter in range(iters):
-       for p in pipes:
-           (nimg, nerr) = p.recv()
-           if nerr < best_err:
-               best_err, best_img = nerr, nimg
-       if counter < (iters - 1):
-           for p in pipes:
-               p.send( (best_img, best_err) )
-       print(f"Iteration {counter} err is {best_err}")
-       if (counter % 10) == 0: 
-          to_save = unpickle_img(best_img)
-          to_save.save(f'out_{counter}.png')
-
-    # save the last image we got
-    to_save = unpickle_img(best_img)
-    to_save.save(f'out_final.png')
-
-    # tell the workers to quit:
-    for p in pipes: p.send( (None, 0) )
-    for j in jobs: j.join()
+    if first >= iters:
+       return
+    tgt_shm, _ = shared_array(tgtarr)
+    best_shm, best = shared_array(start.arr)
+    version = 0
+    writer = SnapshotWriter()
+    def snapshot(name, iteration):
+        writer.save_image(best, f'out_{name}.png')
+        if checkpoint:
+           for p in pipes: p.send( ('checkpoint', best_err, version) )
+           ckpt = Checkpoint(best, iteration, best_err, shape, colors, each, batch, (0, 0),
+                             [ p.recv() for p in pipes ], log.tell() if log else -1)
+           writer.save_checkpoint(checkpoint, ckpt)
+    try:
+       for jno in range(procs):
+          pcon, ccon = mult.Pipe()
+          pipes.append(MeteredPipe(pcon))
+          proc = mult.Process(target=hill_climb_worker,
+                              args=(tgt_shm.name, best_shm.name, tgtarr.shape, colors,
+                                    ccon, each, shape, batch, bool(log), states[jno]))
+          jobs.append(proc)
+          print(f"Created job {jno}")
+          proc.start()
+       for counter in range(first, iters):
+          errs = [ p.recv() for p in pipes ]
+          winner = min(range(procs), key=lambda w: errs[w])
+          if errs[winner] < best_err:
+             version += 1
+             best_err = errs[winner]
+             pipes[winner].send( ('publish', best_err, version) )
+             _, records = pipes[winner].recv()
+             if log: 
+                log.extend(records)
+                log.flush()
+          print(f"Iteration {counter} err is {best_err}")
+          if counter < (iters - 1):
+             if (counter % 10) == 0: snapshot(counter, counter + 1)
+             for p in pipes: p.send( ('sync', best_err, version) )
+
+       # save the last image we got
+       snapshot('final', iters)
+       writer.close()
+       if log: log.close()
+
+       # tell the workers to quit:
+       for p in pipes: p.send( ('quit', 0, 0) )
+       for j in jobs: j.join()
+       traffic = sum(p.bytes for p in pipes)
+       print(f"Pipe traffic: {traffic} bytes, {traffic / max(iters - first, 1):.0f} per iteration")
+    finally:
+       del best
+       for shm in (tgt_shm, best_shm):
+          shm.close()
+          shm.unlink()
+
+def tile_regions(size, grid):
+    """Split an image of SIZE into a GRID of (across, down) tiles.  Returns
+       a list of (parity, region), where the region is the tile grown by a
+       halo, so shapes can cross its edges, and the parity (0-3) is the
+       tile's column and row, mod 2.  The halo is at most half a tile, so
+       the regions of tiles with the same parity never overlap."""
+    wid, ht = size
+    across, down = grid
+    xs = [ wid * i // across for i in range(across + 1) ]
+    ys = [ ht * j // down for j in range(down + 1) ]
+    mh, mw = max_bbox(size)
+    hx = min(mw, min(b - a for a, b in zip(xs, xs[1:])) // 2)
+    hy = min(mh, min(b - a for a, b in zip(ys, ys[1:])) // 2)
+    regions = []
+    for j in range(down):
+        for i in range(across):
+            region = (max(0, xs[i] - hx), max(0, ys[j] - hy), min(wid, xs[i+1] + hx), min(ht, ys[j+1] + hy))
+            if region[2] - region[0] < 2 or region[3] - region[1] < 2:
+                raise ValueError(f'{across}x{down} tiles are too small for a {wid}x{ht} image')
+            regions.append( ((i % 2) + 2 * (j % 2), region) )
+    return regions
+
+def tile_worker(names, shape_hw, colors, mgr, shape, batch=1, log=False, rng_state=None):
+    """control a worker for the tile mode.  NAMES are the shared memory 
+       blocks for the target, the canvas, and its tracker's error and 
+       planes, which everyone paints on directly.  MGR sends:
+          ('climb', regions, tries) : try TRIES shapes inside each of
+                                      REGIONS, and send back how much 
+                                      they changed the total error, and
+                                      the packed shapes kept (if LOG)
+          ('checkpoint', None, 0)   : send back our random state
+          ('quit', None, 0)         : done
+       RNG_STATE, if given, is the random state to start from."""
+    random.seed()
+    if rng_state: random.setstate(rng_state)
+    tgt_shm, tgtarr = attach_array(names[0], shape_hw)
+    canvas_shm, arr = attach_array(names[1], shape_hw)
+    err_shm, err = attach_array(names[2], *names[3])
+    planes_shm, planes = attach_array(names[4], *names[5])
+    canvas = Canvas(arr, copy=False)
+    tracker = ErrorTracker(arr, tgtarr, shared=(err, planes))
+    kept = [] if log else None
+    while True:
+        (cmd, regions, tries) = mgr.recv()
+        if cmd == 'quit':
+           break
+        if cmd == 'checkpoint':
+           mgr.send(random.getstate())
+           continue
+        before = tracker.total
+        for region in regions:
+            if batch > 1:
+               hill_climb_batched(canvas, tracker, colors, tries, shape, batch, region, kept)
+            else:
+               hill_climb(canvas, tracker, colors, tries, shape, region, kept)
+        mgr.send( (tracker.total - before, b''.join(pack_shape(s) for s in kept or [])) )
+        if log: kept.clear()
+    del tgtarr, arr, err, planes, canvas, tracker
+    for shm in (tgt_shm, canvas_shm, err_shm, planes_shm):
+        shm.close()
+
+def manage_tiles(tgt, starting_point, procs, iters, each, shape, batch=1, grid=(8, 4), save=True, log=None,
+                 checkpoint=None, resume=None):
+    """Create PROCS workers that share one canvas, split into a GRID of
+       tiles, and hill-climb it from STARTING_POINT toward TGT for ITERS
+       iterations of EACH shapes.  Each iteration runs in four phases, one
+       per tile parity (see tile_regions), and in each phase the tiles are
+       dealt out to the workers, so no two workers ever touch the same 
+       pixels, and the order their shapes go into LOG (a ShapeLog, if 
+       given) doesn't matter.  With SAVE, snapshots and checkpoints (to 
+       CHECKPOINT, if given) are saved as in manage_workers, and RESUME 
+       works the same way, but with the checkpoint's GRID too.  Returns
+       (the final error, shapes tried per second)."""
+    tgtarr = np.asarray(tgt)
+    first, procs, each, shape, batch, colors, states = resume_settings(resume, procs, each, shape,
+                                                                       batch, get_colors(tgt))
+    if resume: grid = resume.tiles
+    canvas = Canvas(resume.canvas) if resume else Canvas.from_image(starting_point)
+    tracker = ErrorTracker(canvas.arr, tgtarr)
+    total = tracker.total
+    best_err = tracker.rms
+    print(f"Starting with an error of {best_err}")
+    if first >= iters:
+       return best_err, 0.0
+    regions = tile_regions(canvas.size, grid)
+    tries = max(1, each // len(regions))
+    blocks = [ shared_array(a) for a in (tgtarr, canvas.arr) + tracker.buffers ]
+    best = blocks[1][1]
+    err, planes = tracker.buffers
+    names = (blocks[0][0].name, blocks[1][0].name, blocks[2][0].name, (err.shape, err.dtype),
+             blocks[3][0].name, (planes.shape, planes.dtype))
+    pipes, jobs = [], []
+    writer = save and SnapshotWriter()
+    def snapshot(name, iteration):
+        writer.save_image(best, f'out_{name}.png')
+        if checkpoint:
+           for p in pipes: p.send( ('checkpoint', None, 0) )
+           ckpt = Checkpoint(best, iteration, best_err, shape, colors, each, batch, grid,
+                             [ p.recv() for p in pipes ], log.tell() if log else -1)
+           writer.save_checkpoint(checkpoint, ckpt)
+    try:
+       for jno in range(procs):
+          pcon, ccon = mult.Pipe()
+          pipes.append(pcon)
+          proc = mult.Process(target=tile_worker,
+                              args=(names, tgtarr.shape, colors, ccon, shape, batch, bool(log),
+                                    states[jno]))
+          jobs.append(proc)
+          proc.start()
+       started = time.perf_counter()
+       for counter in range(first, iters):
+          for parity in range(4):
+             active = [ region for par, region in regions if par == parity ]
+             for w, p in enumerate(pipes):
+                p.send( ('climb', active[w::procs], tries) )
+             for p in pipes:
+                delta, records = p.recv()
+                total += delta
+                if log: log.extend(records)
+          best_err = (total / tracker.pixels) ** 0.5
+          print(f"Iteration {counter} err is {best_err}")
+          if log: log.flush()
+          if save and (counter % 10) == 0: 
+             snapshot(counter, counter + 1)
+       rate = (iters - first) * tries * len(regions) / (time.perf_counter() - started)
+       if save:
+          snapshot('final', iters)
+          writer.close()
+       if log: log.close()
+       for p in pipes: p.send( ('quit', None, 0) )
+       for j in jobs: j.join()
+    finally:
+       shms = [ shm for shm, _ in blocks ]
+       del best, blocks
+       for shm in shms:
+          shm.close()
+          shm.unlink()
+    return best_err, rate
 
 if __name__=='__main__':
   import argparse
@@ -161,10 +343,22 @@ if __name__=='__main__':
   parser.add_argument("-e", dest="each", type=int, default=5000, help="number of shapes to try per iteration")
   parser.add_argument("-d", dest="shape", choices=list(drawers.keys()), default="filled_ellipse", help="the type of shape to draw")
   parser.add_argument("-j", dest="jobs", type=int, default=3, help="how many processes to launch")
+  parser.add_argument("-k", dest="batch", type=int, default=1, help="number of shapes to score at once")
+  parser.add_argument("-t", "--tiles", dest="tiles", help="ACROSSxDOWN: split the image into tiles the jobs share, instead of racing")
+  parser.add_argument("-l", dest="log", help="append the shapes kept to this shape log (continuing it, with -s or -r)")
+  parser.add_argument("-c", dest="checkpoint", default="out_checkpoint.npz", help="where to save checkpoints ('' for nowhere)")
+  parser.add_argument("-r", dest="resume", help="checkpoint to resume from (in place of -s, -e, -d, -j, -k and -t)")
   args = parser.parse_args()
 
   myimg = Image.open(args.target).convert('RGB')
   starter = args.start and Image.open(args.start).convert('RGB') or same_size_blank(myimg)
-  manage_workers(myimg, starter, args.jobs, args.iterations, args.each, args.shape)
-
-
+  resume = args.resume and read_checkpoint(args.resume)
+  log = args.log and ShapeLog(args.log, myimg.size, append=bool(args.start or resume),
+                              at=resume and resume.log_offset >= 0 and resume.log_offset or None)
+  grid = resume.tiles if resume else args.tiles and tuple(int(n) for n in args.tiles.lower().split('x'))
+  if grid and any(grid):
+     manage_tiles(myimg, starter, args.jobs, args.iterations, args.each, args.shape, args.batch, grid,
+                  log=log, checkpoint=args.checkpoint, resume=resume)
+  else:
+     manage_workers(myimg, starter, args.jobs, args.iterations, args.each, args.shape, args.batch, log,
+                    args.checkpoint, resume)